@@ -1,5 +1,6 @@
 import os
 import sqlite3
+import time
 from datetime import datetime, timedelta
 from functools import wraps
 from io import BytesIO
@@ -8,14 +9,27 @@ import json
 import pandas as pd 
 from flask import (
     Flask, render_template, request, jsonify, send_file, g,
-    redirect, url_for, session, flash
+    redirect, url_for, session, flash, send_from_directory
 )
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import zipfile
 import shapefile
 import shutil
-import pyproj
+
+import busqueda
+import cache_resultados
+import columnar
+import duplicados
+import importacion
+import lectura
+import od
+import particiones
+import proximidad
+import proyecciones
+import respaldo
+import sesiones
+import sprites
 
 BASE_DIR = os.path.dirname(__file__)
 DB_PATH = os.path.join(BASE_DIR, "pines.db")
@@ -27,6 +41,12 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "cambia_esta_llave_supersecreta")
 # Tiempo de vida de la sesión (3 minutos de inactividad)
 app.permanent_session_lifetime = timedelta(minutes=3)
+# Sesiones guardadas en el servidor; la cookie sólo lleva un id (ver sesiones.py)
+app.session_interface = sesiones.InterfazSesionServidor()
+# Caché en disco de /api/pins y /exportar/excel, compartida entre workers
+resultados = cache_resultados.CacheResultados()
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
 
 # -----------------------
@@ -50,6 +70,9 @@ def init_db():
     db = get_db()
     cursor = db.cursor()
 
+    # WAL: las lecturas largas (respaldos, exportaciones) no bloquean escrituras
+    cursor.execute("PRAGMA journal_mode=WAL")
+
     # Tabla para las visitas (datos del formulario login.html)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS visitas (
@@ -148,9 +171,29 @@ def init_db():
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_pines_created ON pines(creado_en)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_visitas_created ON visitas(creado_en)")
 
+    # Control de importaciones históricas (ver importacion.py)
+    importacion.crear_tablas(db)
+    # Registro de periodos archivados (ver particiones.py)
+    particiones.crear_tablas(db)
+    # Índice por celda y llaves de idempotencia (ver duplicados.py)
+    duplicados.crear_tablas(db)
+    # Índice de búsqueda sobre atributos de capas (ver busqueda.py)
+    busqueda.crear_tablas(db)
+    busqueda.indexar_faltantes(db)
+    # Contador de escrituras para la caché de resultados (ver cache_resultados.py)
+    cache_resultados.crear_tablas(db)
+    # Agregados de la matriz origen-destino (ver od.py)
+    od.crear_tablas(db)
+    if od.vacio(db):
+        od.reconstruir(db)
+
     db.commit()
 
 
+# gunicorn importa `app:app` sin pasar por __main__: el esquema (tablas
+# nuevas, WAL) se prepara aquí, una vez por proceso al importar el módulo.
+with app.app_context():
+    init_db()
 
 
 # -----------------------
@@ -190,29 +233,21 @@ def enforce_idle_timeout():
     if "user_id" not in session and "visita_id" not in session:
         return
 
-    now = datetime.utcnow()
+    # La última actividad vive en el almacén de sesiones, no en la cookie
+    last = session.ultima_actividad
+    if last and time.time() - last > app.permanent_session_lifetime.total_seconds():
+        session.clear()
+        flash("Sesión finalizada por inactividad.", "warn")
 
-    last = session.get("last_activity")
-    if last:
-        try:
-            last_dt = datetime.fromisoformat(last)
-            if now - last_dt > app.permanent_session_lifetime:
-                session.clear()
-                flash("Sesión finalizada por inactividad.", "warn")
+        # ✅ Redirección interna
+        if EXPIRE_REDIRECT_ENDPOINT:
+            return redirect(url_for(EXPIRE_REDIRECT_ENDPOINT))
 
-                # ✅ Redirección interna
-                if EXPIRE_REDIRECT_ENDPOINT:
-                    return redirect(url_for(EXPIRE_REDIRECT_ENDPOINT))
+        # ✅ Redirección externa
+        return redirect(EXPIRE_REDIRECT_URL)
 
-                # ✅ Redirección externa
-                return redirect(EXPIRE_REDIRECT_URL)
-        except Exception:
-            # si last_activity está corrupto, lo limpiamos
-            session.pop("last_activity", None)
-
-    # Actualiza actividad
-    session["last_activity"] = now.isoformat()
-    session.permanent = True
+    # Actualiza actividad (se escribe como mucho cada pocos segundos)
+    session.tocar()
 
 # -----------------------
 # Rutas principales
@@ -248,7 +283,6 @@ def get_pins():
         SELECT id, visita_id, codigo_pin, nom, idu, lon, lat, creado_en
         FROM pines
     """
-    params, clauses = [], []
 
     date_str = request.args.get("date")
     start = request.args.get("start")
@@ -257,9 +291,8 @@ def get_pins():
     year = request.args.get("year")
 
     if date_str:
-        clauses.append("strftime('%Y-%m-%d', creado_en) = ?")
         try:
-            params.append(datetime.fromisoformat(date_str).date().isoformat())
+            datetime.fromisoformat(date_str)
         except ValueError:
             return jsonify({"error": "date inválida (YYYY-MM-DD)"}), 400
 
@@ -269,14 +302,10 @@ def get_pins():
             datetime(int(y), int(m), 1)
         except Exception:
             return jsonify({"error": "month inválido (YYYY-MM)"}), 400
-        clauses.append("strftime('%Y-%m', creado_en) = ?")
-        params.append(month)
 
     if year:
         if not (year.isdigit() and len(year) == 4):
             return jsonify({"error": "year inválido (YYYY)"}), 400
-        clauses.append("strftime('%Y', creado_en) = ?")
-        params.append(year)
 
     if start or end:
         if start:
@@ -284,22 +313,193 @@ def get_pins():
                 datetime.fromisoformat(start)
             except ValueError:
                 return jsonify({"error": "start inválida (YYYY-MM-DD)"}), 400
-            clauses.append("date(creado_en) >= ?")
-            params.append(start)
         if end:
             try:
                 datetime.fromisoformat(end)
             except ValueError:
                 return jsonify({"error": "end inválida (YYYY-MM-DD)"}), 400
-            clauses.append("date(creado_en) <= ?")
-            params.append(end)
 
+    fmt = request.args.get("format", "json")
+    if fmt not in ("json", "columnar", "binary"):
+        return jsonify({"error": "format inválido (json|columnar|binary)"}), 400
+
+    # Proximidad a una capa de puntos: ?capa=<archivo>.json&radio=<metros>
+    capa = request.args.get("capa")
+    radio = request.args.get("radio")
+    indice = None
+    if capa:
+        indice, error = _indice_capa(db, capa)
+        if error:
+            return jsonify({"error": error}), 400
+    if radio:
+        if not indice:
+            return jsonify({"error": "radio requiere capa"}), 400
+        try:
+            radio = float(radio)
+        except ValueError:
+            return jsonify({"error": "radio inválido (metros)"}), 400
+
+    # Sólo se consultan las particiones archivadas que cruzan el rango pedido
+    rango = particiones.rango_de_filtros(date_str, month, year, start, end)
+    clauses, params = _filtro_rango(rango)
     if clauses:
         q += " WHERE " + " AND ".join(clauses)
-    q += " ORDER BY id DESC"
 
-    rows = db.execute(q, params).fetchall()
-    return jsonify([dict(r) for r in rows]), 200
+    # Resultado ya calculado para los mismos filtros (ver cache_resultados.py)
+    capa_version = os.path.getmtime(os.path.join(LAYERS_DIR, capa)) if indice else None
+    clave = _clave_cache("pins", rango, db, fmt, capa, capa_version, radio)
+    guardado = resultados.obtener(clave)
+    if guardado:
+        return app.response_class(guardado[0], mimetype=guardado[1])
+
+    rows = particiones.consultar(db, q, params, rango, orden="id DESC")
+
+    dist = None
+    if indice:
+        dist, _ = indice.cercanos([r["lat"] for r in rows], [r["lon"] for r in rows])
+        if radio:
+            cerca = dist <= radio
+            rows = [r for r, ok in zip(rows, cerca.tolist()) if ok]
+            dist = dist[cerca]
+
+    # Formatos compactos (ver columnar.py)
+    if fmt == "columnar":
+        resp = app.response_class(columnar.a_json(columnar.columnas(rows, dist)), mimetype="application/json")
+    elif fmt == "binary":
+        resp = app.response_class(columnar.a_binario(columnar.columnas(rows, dist)), mimetype="application/octet-stream")
+    elif dist is None:
+        resp = jsonify([dict(r) for r in rows])
+    else:
+        data = []
+        for r, d in zip(rows, dist.tolist()):
+            item = dict(r)
+            item["distancia_m"] = round(d, 1)
+            data.append(item)
+        resp = jsonify(data)
+
+    resultados.guardar(clave, resp.get_data(), resp.mimetype)
+    return resp, 200
+
+
+def _filtro_rango(rango):
+    """
+    Condiciones sobre creado_en con el rango ya normalizado: la consulta y la
+    llave de caché usan los mismos valores (`start=20251101` o `month=2025-1`
+    filtran igual que su forma YYYY-MM-DD / YYYY-MM).
+    """
+    desde, hasta = rango
+    clauses, params = [], []
+    if desde:
+        clauses.append("date(creado_en) >= ?")
+        params.append(desde)
+    if hasta:
+        clauses.append("date(creado_en) <= ?")
+        params.append(hasta)
+    return clauses, params
+
+
+def _clave_cache(tipo, rango, db, *extra):
+    """Llave de caché: filtros normalizados y, si el rango sigue abierto, la versión de escrituras."""
+    version = None if cache_resultados.cerrado(rango[1]) else cache_resultados.version(db)
+    return resultados.clave(tipo, *rango, version, *extra)
+
+
+def _indice_capa(db, filename):
+    """Índice de proximidad de una capa registrada, o (None, mensaje de error)."""
+    row = db.execute("SELECT filename FROM layers WHERE filename=?", (filename,)).fetchone()
+    if not row or not os.path.exists(os.path.join(LAYERS_DIR, row["filename"])):
+        return None, "capa no encontrada"
+    indice = proximidad.obtener(row["filename"])
+    if not len(indice):
+        return None, "la capa no tiene puntos"
+    return indice, None
+
+
+@app.route("/api/proximidad", methods=["POST"])
+def proximidad_pins():
+    """
+    Distancia de cada pin (por id) o punto (lat/lon) a la feature más cercana
+    de una capa de puntos. Body: {"capa": "...json", "ids": [...]} o
+    {"capa": "...json", "puntos": [{"lat": .., "lon": ..}]}. Los ids se
+    buscan también en los periodos archivados; los que no existen se omiten.
+    """
+    payload = request.get_json(force=True) or {}
+    db = get_db()
+    indice, error = _indice_capa(db, payload.get("capa") or "")
+    if error:
+        return jsonify({"error": error}), 400
+
+    ids = payload.get("ids")
+    puntos = payload.get("puntos")
+    if isinstance(ids, list) and ids:
+        try:
+            ids = [int(i) for i in ids]
+        except (TypeError, ValueError):
+            return jsonify({"error": "ids inválidos"}), 400
+        marks = ",".join("?" * len(ids))
+        # Sin rango: los ids pueden estar en cualquier periodo archivado
+        rows = particiones.consultar(db, f"SELECT id, lat, lon FROM pines WHERE id IN ({marks})", ids)
+        claves = [{"id": r["id"]} for r in rows]
+        lat = [r["lat"] for r in rows]
+        lon = [r["lon"] for r in rows]
+    elif isinstance(puntos, list) and puntos:
+        try:
+            lat = [float(p["lat"]) for p in puntos]
+            lon = [float(p["lon"]) for p in puntos]
+        except (TypeError, ValueError, KeyError):
+            return jsonify({"error": "puntos inválidos (lat/lon)"}), 400
+        claves = [{"lat": a, "lon": b} for a, b in zip(lat, lon)]
+    else:
+        return jsonify({"error": "Envía ids[] o puntos[]"}), 400
+
+    dist, idx = indice.cercanos(lat, lon)
+    data = []
+    for clave, d, i in zip(claves, dist.tolist(), idx.tolist()):
+        clave["distancia_m"] = round(d, 1)
+        clave["feature"] = indice.features[i].get("properties") or {}
+        data.append(clave)
+    return jsonify(data), 200
+
+
+# -----------------------
+# API Matriz origen-destino
+# -----------------------
+@app.route("/api/od", methods=["GET"])
+def get_od():
+    """
+    Flujos origen->destino de las visitas, leídos de las tablas agregadas
+    de od.py. Filtros: date/month/year/start/end como /api/pins, edad
+    (rangos separados por coma, p. ej. 18-24,25-34) y categoria
+    (movilidad, violencia o todas) para incluir los pines de cada flujo.
+    """
+    year = request.args.get("year")
+    if year and not (year.isdigit() and len(year) == 4):
+        return jsonify({"error": "year inválido (YYYY)"}), 400
+
+    try:
+        desde, hasta = particiones.rango_de_filtros(
+            request.args.get("date"), request.args.get("month"), year,
+            request.args.get("start"), request.args.get("end"),
+        )
+    except (ValueError, TypeError):
+        return jsonify({"error": "Filtro de fecha inválido (YYYY-MM-DD, YYYY-MM o YYYY)"}), 400
+
+    validos = [nombre for _, nombre in od.RANGOS_EDAD] + [od.SIN_DATO]
+    edades = [e.strip() for e in (request.args.get("edad") or "").split(",") if e.strip()]
+    for e in edades:
+        if e not in validos:
+            return jsonify({"error": f"edad inválida; usa {', '.join(validos)}"}), 400
+
+    db = get_db()
+    categoria = (request.args.get("categoria") or "").strip() or None
+    if categoria and categoria != "todas":
+        existe = db.execute("SELECT 1 FROM catalogo_pines WHERE categoria=? LIMIT 1", (categoria,)).fetchone()
+        if not existe:
+            return jsonify({"error": "categoria inválida"}), 400
+
+    data = od.matriz(db, desde, hasta, edades, categoria)
+    data["filtros"] = {"desde": desde, "hasta": hasta, "edad": edades, "categoria": categoria}
+    return jsonify(data), 200
 
 
 @app.route("/api/pins", methods=["POST"])
@@ -326,7 +526,15 @@ def add_pin():
     dentro_val = 1 if dentro else 0
 
     db = get_db()
-    db.execute(
+    # Se toma la escritura antes de buscar duplicados para que dos envíos
+    # simultáneos del mismo pin no pasen los dos (ver duplicados.py)
+    db.execute("BEGIN IMMEDIATE")
+    previo = duplicados.Filtro(db).duplicado_de(int(visita_id), codigo_pin, float(lat), float(lon))
+    if previo:
+        db.rollback()
+        return jsonify({"ok": True, "id": previo, "duplicado": True}), 200
+
+    cursor = db.execute(
         """
         INSERT INTO pines (visita_id, codigo_pin, lat, lon, nom, idu, dentro_malla, creado_en)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
@@ -342,8 +550,10 @@ def add_pin():
             datetime.now().isoformat(timespec="seconds"),
         ),
     )
+    new_id = cursor.lastrowid
+    od.registrar_pines(db, new_id, new_id)
+    cache_resultados.registrar_escritura(db)
     db.commit()
-    new_id = db.execute("SELECT last_insert_rowid() AS id").fetchone()["id"]
     return jsonify({"ok": True, "id": new_id}), 201
 
 
@@ -383,7 +593,6 @@ def save_settings():
 @app.route("/exportar/excel", methods=["GET"])
 @admin_required
 def export_excel():
-    db = get_db()
     date_str = request.args.get("date")
     start = request.args.get("start")
     end = request.args.get("end")
@@ -394,15 +603,12 @@ def export_excel():
         SELECT id, visita_id, codigo_pin, nom, idu, lon, lat, creado_en
         FROM pines
     """
-    params, clauses = [], []
 
     if date_str:
         try:
             datetime.fromisoformat(date_str)
         except ValueError:
             return "date inválida (YYYY-MM-DD)", 400
-        clauses.append("strftime('%Y-%m-%d', creado_en) = ?")
-        params.append(date_str)
 
     if month:
         try:
@@ -410,14 +616,10 @@ def export_excel():
             datetime(int(y), int(m), 1)
         except Exception:
             return "month inválido (YYYY-MM)", 400
-        clauses.append("strftime('%Y-%m', creado_en) = ?")
-        params.append(month)
 
     if year:
         if not (year.isdigit() and len(year) == 4):
             return "year inválido (YYYY)", 400
-        clauses.append("strftime('%Y', creado_en) = ?")
-        params.append(year)
 
     if start or end:
         if start:
@@ -425,30 +627,42 @@ def export_excel():
                 datetime.fromisoformat(start)
             except ValueError:
                 return "start inválida (YYYY-MM-DD)", 400
-            clauses.append("date(creado_en) >= ?")
-            params.append(start)
         if end:
             try:
                 datetime.fromisoformat(end)
             except ValueError:
                 return "end inválida (YYYY-MM-DD)", 400
-            clauses.append("date(creado_en) <= ?")
-            params.append(end)
 
+    rango = particiones.rango_de_filtros(date_str, month, year, start, end)
+    clauses, params = _filtro_rango(rango)
     where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
-    df = pd.read_sql_query(base + where + " ORDER BY id", db, params=params)
-
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        df.to_excel(writer, sheet_name="Pines", index=False)
-        ws = writer.sheets["Pines"]
-        for i, col in enumerate(df.columns):
-            width = min(
-                max([len(str(x)) for x in df[col].astype(str).values] + [len(col)]) + 2,
-                40,
-            )
-            ws.set_column(i, i, width)
-    output.seek(0)
+    # Conexión de sólo lectura con foto fija (ver lectura.py)
+    with lectura.conexion() as db:
+        clave = _clave_cache("excel", rango, db)
+        guardado = resultados.obtener(clave)
+        if guardado is None:
+            rows = particiones.consultar(db, base + where, params, rango, orden="id")
+
+    if guardado is None:
+        df = pd.DataFrame(
+            [tuple(r) for r in rows],
+            columns=["id", "visita_id", "codigo_pin", "nom", "idu", "lon", "lat", "creado_en"],
+        )
+
+        output = BytesIO()
+        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+            df.to_excel(writer, sheet_name="Pines", index=False)
+            ws = writer.sheets["Pines"]
+            for i, col in enumerate(df.columns):
+                width = min(
+                    max([len(str(x)) for x in df[col].astype(str).values] + [len(col)]) + 2,
+                    40,
+                )
+                ws.set_column(i, i, width)
+        resultados.guardar(clave, output.getvalue(), XLSX_MIMETYPE)
+        output.seek(0)
+    else:
+        output = BytesIO(guardado[0])
 
     kind = (
         f"dia_{date_str}"
@@ -464,7 +678,7 @@ def export_excel():
         output,
         as_attachment=True,
         download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        mimetype=XLSX_MIMETYPE,
     )
 
 
@@ -482,7 +696,10 @@ def admin_panel():
         "SELECT center_lon, center_lat, zoom FROM settings WHERE id=1"
     ).fetchone()
     layers = db.execute("SELECT * FROM layers ORDER BY created_at DESC").fetchall()
-    return render_template("panel_administracion.html", admins=admins, settings=s, layers=layers)
+    return render_template(
+        "panel_administracion.html", admins=admins, settings=s, layers=layers,
+        respaldos=respaldo.listar(),
+    )
 
 
 @app.route("/admin/create", methods=["POST"])
@@ -529,6 +746,7 @@ def admin_login():
         user = db.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
         
         if user and check_password_hash(user["password_hash"], password):
+            session.regenerar()
             session["user_id"] = user["id"]
             session["username"] = user["username"]
             session["role"] = user["role"]
@@ -602,6 +820,7 @@ def login():
         flash("Origen y destino son obligatorios.", "error")
         return render_template("login.html")
 
+    creado_en = datetime.now().isoformat(timespec="seconds")
     db = get_db()
     cursor = db.cursor()
     cursor.execute(
@@ -609,15 +828,15 @@ def login():
         INSERT INTO visitas (edad, origen, destino, creado_en)
         VALUES (?, ?, ?, ?)
         """,
-        (edad, origen, destino, datetime.now().isoformat(timespec="seconds")),
+        (edad, origen, destino, creado_en),
     )
+    visita_id = cursor.lastrowid
+    od.registrar_visita(db, visita_id, edad, origen, destino, creado_en)
     db.commit()
 
-    visita_id = cursor.lastrowid
+    session.regenerar()
     session["visita_id"] = visita_id
     session.permanent = True
-    session["last_activity"] = datetime.utcnow().isoformat()
-
 
     return redirect(url_for("index", folio=visita_id))
 
@@ -670,17 +889,47 @@ def add_pins_bulk():
         except Exception:
             return jsonify({"error": f"Pin #{i}: datos inválidos"}), 400
 
+    llave = request.headers.get("Idempotency-Key") or payload.get("idempotency_key")
+
     db = get_db()
-    db.executemany(
-        """
-        INSERT INTO pines (visita_id, codigo_pin, lat, lon, nom, idu, dentro_malla ,creado_en)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        rows_to_insert
-    )
+    db.execute("BEGIN IMMEDIATE")
+    if llave:
+        # Reintento de una petición ya guardada: se devuelve la misma respuesta
+        try:
+            previa = duplicados.reservar_llave(db, str(llave)[:200], int(visita_id))
+        except ValueError as e:
+            db.rollback()
+            return jsonify({"error": str(e)}), 409
+        if previa is not None:
+            db.rollback()
+            return jsonify(previa), 200
+
+    filtro = duplicados.Filtro(db)
+    nuevos, repetidos = [], []
+    for i, row in enumerate(rows_to_insert):
+        if filtro.duplicado_de(*row[:4]) is None:
+            nuevos.append(row)
+        else:
+            repetidos.append(i)
+
+    if nuevos:
+        db.executemany(
+            """
+            INSERT INTO pines (visita_id, codigo_pin, lat, lon, nom, idu, dentro_malla ,creado_en)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            nuevos
+        )
+        ultimo = db.execute("SELECT last_insert_rowid()").fetchone()[0]
+        od.registrar_pines(db, ultimo - len(nuevos) + 1, ultimo)
+        cache_resultados.registrar_escritura(db)
+
+    respuesta = {"ok": True, "saved": len(nuevos), "duplicados": repetidos}
+    if llave:
+        duplicados.guardar_respuesta(db, str(llave)[:200], respuesta)
     db.commit()
 
-    return jsonify({"ok": True, "saved": len(rows_to_insert)}), 201
+    return jsonify(respuesta), 201
 
 # -----------------------
 # Gestión de capas (Archivos Shapefile)
@@ -710,11 +959,18 @@ def upload_layer():
              flash("Icono inválido. Usa PNG, JPG o SVG.", "error")
              return redirect(url_for("admin_panel"))
         
-        # Guardar icono
+        # Guardar icono (los raster se normalizan a tamaño de marcador en PNG)
         ext = os.path.splitext(icon_file.filename)[1].lower()
-        icon_name = f"{secure_filename(name)}_icon{ext}"
-        icon_path = os.path.join(LAYERS_DIR, icon_name)
-        icon_file.save(icon_path)
+        if ext == ".svg":
+            icon_name = f"{secure_filename(name)}_icon{ext}"
+            icon_file.save(os.path.join(LAYERS_DIR, icon_name))
+        else:
+            icon_name = f"{secure_filename(name)}_icon.png"
+            try:
+                sprites.normalizar_icono(icon_file.stream, os.path.join(LAYERS_DIR, icon_name))
+            except Exception:
+                flash("No se pudo leer la imagen del icono.", "error")
+                return redirect(url_for("admin_panel"))
         icon_filename = icon_name
 
     if not file.filename.lower().endswith(".zip"):
@@ -762,10 +1018,8 @@ def upload_layer():
             records = sf.records()
             shapes = sf.shapes()
 
-            # Preparar reproyección de UTM zona 14N a WGS84
-            # (Asumiendo datos de CDMX que usualmente son UTM 14N, EPSG:32614)
-            # Para mayor robustez idealmente se leería el archivo .prj, pero requiere GDAL
-            transformer = pyproj.Transformer.from_crs("epsg:32614", "epsg:4326", always_xy=True)
+            # Sistema de coordenadas de la capa (.prj); se reproyecta completa a WGS84
+            crs = proyecciones.crs_de_shapefile(shp_file, sf.bbox if len(shapes) else None)
 
             features = []
             for i, shp in enumerate(shapes):
@@ -773,27 +1027,8 @@ def upload_layer():
                 
                 # Manejo de records
                 rec = records[i]
-                
-                # Transformar geometría si parece proyectada (valores grandes)
-                # Simple check: si x > 180, asumimos proyectada
                 geo = shp.__geo_interface__
                 
-                def reproject_coords(coords):
-                    if isinstance(coords[0], (list, tuple)):
-                        return [reproject_coords(c) for c in coords]
-                    else:
-                        # Si es coordenada simple (x, y)
-                        x, y = coords[0], coords[1]
-                        if x > 180 or x < -180:
-                            lon, lat = transformer.transform(x, y)
-                            return [lon, lat]
-                        return [x, y]
-
-                if geo['type'] == 'Point':
-                    geo['coordinates'] = reproject_coords(geo['coordinates'])
-                elif geo['type'] in ['Polygon', 'LineString', 'MultiPolygon', 'MultiLineString']:
-                    geo['coordinates'] = reproject_coords(geo['coordinates'])
-                
                 # Convertir a dict
                 props = {}
                 for j, field_name in enumerate(fields):
@@ -810,6 +1045,8 @@ def upload_layer():
                 }
                 features.append(feature)
 
+            proyecciones.reproyectar([f["geometry"] for f in features], crs)
+
             geojson = {
                 "type": "FeatureCollection",
                 "features": features
@@ -818,6 +1055,9 @@ def upload_layer():
             with open(json_path, "w", encoding="utf-8") as f:
                 json.dump(geojson, f)
 
+            # Atributos y bbox al índice de búsqueda (ver busqueda.py)
+            busqueda.indexar_capa(db, json_filename, features)
+
         if existing:
             # Si sube nuevo icono, actualizamos. Si no, mantenemos el anterior (o null si quiere borrar? por ahora simple)
             update_sql = "UPDATE layers SET created_at=?, color=?"
@@ -839,21 +1079,94 @@ def upload_layer():
         
         db.commit()
 
+        proximidad.reconstruir(json_filename)
+        if icon_filename:
+            sprites.reconstruir_desde_db(db)
+
     except Exception as e:
         flash(f"Error procesando shapefile: {str(e)}", "error")
 
     return redirect(url_for("admin_panel"))
 
+# -----------------------
+# Respaldos en línea (ver respaldo.py)
+# -----------------------
+@app.route("/admin/respaldos/crear", methods=["POST"])
+@admin_required
+def crear_respaldo():
+    try:
+        ruta = respaldo.crear_respaldo(DB_PATH)
+        flash(f"Respaldo creado: {os.path.basename(ruta)}", "ok")
+    except Exception as e:
+        flash(f"Error creando respaldo: {str(e)}", "error")
+    return redirect(url_for("admin_panel"))
+
+
+@app.route("/admin/respaldos/restaurar", methods=["POST"])
+@admin_required
+def restaurar_respaldo():
+    nombre = request.form.get("nombre") or ""
+    try:
+        previo = respaldo.restaurar(nombre, DB_PATH)
+        resultados.invalidar_todo()
+        flash(f"Base restaurada desde {nombre}. Estado previo: {os.path.basename(previo)}", "ok")
+    except Exception as e:
+        flash(f"Error restaurando respaldo: {str(e)}", "error")
+    return redirect(url_for("admin_panel"))
+
+
+# -----------------------
+# Importación histórica (CSV/XLSX)
+# -----------------------
+@app.route("/admin/importar", methods=["POST"])
+@admin_required
+def importar_historico():
+    file = request.files.get("archivo")
+    if not file or file.filename == "":
+        flash("No se seleccionó archivo", "error")
+        return redirect(url_for("admin_panel"))
+
+    ext = os.path.splitext(file.filename)[1].lower()
+    if ext not in (".csv", ".xlsx"):
+        flash("Solo se permiten archivos .csv o .xlsx", "error")
+        return redirect(url_for("admin_panel"))
+
+    lote = (request.form.get("lote") or "").strip() or None
+    try:
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            path = os.path.join(tmpdirname, f"importacion{ext}")
+            file.save(path)
+            resumen = importacion.importar_archivo(path, DB_PATH, lote=lote)
+    except Exception as e:
+        flash(f"Error importando archivo: {str(e)}", "error")
+        return redirect(url_for("admin_panel"))
+
+    for tabla, r in resumen["tablas"].items():
+        flash(
+            f"{tabla}: {r['insertadas']} insertadas, {r['rechazadas']} rechazadas, "
+            f"{r['omitidas']} ya importadas antes "
+            f"(en total el lote lleva {r['total']['insertadas']} insertadas, "
+            f"{r['total']['rechazadas']} rechazadas).",
+            "ok",
+        )
+    if not resumen["tablas"]:
+        flash("El archivo no contiene hojas visitas ni pines.", "warn")
+    return redirect(url_for("admin_panel"))
+
+
 @app.route("/admin/delete_layer/<filename>", methods=["POST"])
 @admin_required
 def delete_layer(filename):
     db = get_db()
     db.execute("DELETE FROM layers WHERE filename=?", (filename,))
+    busqueda.descartar(db, filename)
     db.commit()
 
     path = os.path.join(LAYERS_DIR, secure_filename(filename))
     if os.path.exists(path):
         os.remove(path)
+    proximidad.descartar(filename)
     
     flash("Capa eliminada.", "ok")
     return redirect(url_for("admin_panel"))
@@ -869,10 +1182,51 @@ def get_layers_api():
             "name": l["name"],
             "color": l["color"] or "#3388ff",
             "icon": icon_url,
+            "sprite": sprites.PREFIJO_CAPA + l["icon"] if l["icon"] else None,
             "url": url_for('static', filename=f'layers/{l["filename"]}')
         })
     return jsonify(data)
 
+
+@app.route("/api/layers/search")
+def search_layers_api():
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"error": "Falta el texto a buscar (q)"}), 400
+    try:
+        limite = int(request.args.get("limit", 20))
+    except ValueError:
+        return jsonify({"error": "limit inválido"}), 400
+    if limite < 1:
+        return jsonify({"error": "limit inválido"}), 400
+
+    resultados = busqueda.buscar(get_db(), q, request.args.get("capa"), limite)
+    return jsonify(resultados), 200
+
+
+# -----------------------
+# Atlas de iconos (sprite)
+# -----------------------
+@app.route("/api/sprites")
+def get_sprites_api():
+    indice = sprites.cargar_indice()
+    if indice is None:
+        indice = sprites.reconstruir_desde_db(get_db())
+    data = dict(indice)
+    data["webp"] = url_for("sprite_file", filename=indice["webp"])
+    data["png"] = url_for("sprite_file", filename=indice["png"])
+    resp = jsonify(data)
+    # El índice cambia al subir capas; las imágenes llevan hash y no caducan
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+@app.route("/sprites/<path:filename>")
+def sprite_file(filename):
+    resp = send_from_directory(sprites.SPRITES_DIR, filename, max_age=31536000)
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp
+
 """
 Cración de ruta para descarga de BD en formato Excel, usando la función exportar_base_datos_excel de base_datos.py
 """
@@ -931,8 +1285,8 @@ def point_in_polygon(lat, lon, polygon):
 # Main
 # -----------------------
 if __name__ == "__main__":
-    # Inicializamos la BD al arrancar la app
+    # La BD ya se inicializó al importar el módulo
     with app.app_context():
-        init_db()
+        sprites.reconstruir_desde_db(get_db())
 
     app.run(host="0.0.0.0", port=8889, debug=True)
@@ -1,28 +1,347 @@
-import sqlite3
+"""
+Volcado de tablas de pines.db a texto, CSV, NDJSON o SQL.
 
-# Conectar a la base de datos
-conn = sqlite3.connect("pines.db")
-cursor = conn.cursor()
+Las filas se leen del cursor por bloques (`fetchmany`) y se escriben directo
+al archivo, así que la memoria no crece con el tamaño de la base. La lectura
+usa una conexión de sólo lectura con foto fija (ver lectura.py): el volcado
+es consistente y no bloquea a quien esté guardando pines.
 
-# Obtener todas las tablas
-cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-tablas = cursor.fetchall()
+Sin argumentos hace lo mismo que antes: todas las tablas en formato texto a
+pines_export.txt.
 
-output = "Tablas en la base de datos:\n"
+Uso desde consola:
+    python base__datos_consulta.py
+    python base__datos_consulta.py -t pines -t visitas --desde 2025-11-01 --hasta 2025-11-30
+    python base__datos_consulta.py -f csv -t pines -o pines.csv --gzip
+    python base__datos_consulta.py -f ndjson -o - | head
+    python base__datos_consulta.py -f sql -o respaldo.sql.gz --gzip
 
-for (tabla,) in tablas:
-    output += f"\n===== TABLA: {tabla} =====\n"
+- `--desde/--hasta` se aplican a las tablas con columna `creado_en`; las demás
+  se vuelcan completas.
+- Las filas de `pines` y `visitas` archivadas en archivo/*.db (ver
+  particiones.py) se incluyen, antes que las de la base viva, si su periodo
+  se cruza con el rango. `--solo-viva` las omite y avisa cuáles quedaron fuera.
+- En CSV cada tabla va a su propio archivo (`pines.csv` -> `pines.visitas.csv`
+  si se piden varias).
+- En NDJSON cada línea lleva el nombre de la tabla en `"_tabla"`.
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import date
 
-    cursor.execute(f"SELECT * FROM {tabla}")
-    filas = cursor.fetchall()
+import lectura
+import particiones
 
-    for fila in filas:
-        output += str(fila) + "\n"
+BASE_DIR = os.path.dirname(__file__)
+DB_PATH = os.path.join(BASE_DIR, "pines.db")
 
-conn.close()
+FORMATOS = ("texto", "csv", "ndjson", "sql")
+EXTENSIONES = {"texto": ".txt", "csv": ".csv", "ndjson": ".ndjson", "sql": ".sql"}
+TAM_LOTE = 5000
 
-# Guardar en archivo .txt
-with open("pines_export.txt", "w", encoding="utf-8") as archivo:
-    archivo.write(output)
 
-print("Exportación completada: pines_export.txt")
\ No newline at end of file
+# -----------------------
+# Tablas y consultas
+# -----------------------
+def tablas_disponibles(conn):
+    """Tablas normales (sin internas de SQLite, tablas virtuales ni sus tablas sombra)."""
+    filas = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY rowid"
+    ).fetchall()
+    virtuales = [n for n, sql in filas if (sql or "").upper().startswith("CREATE VIRTUAL")]
+    return [
+        n for n, _ in filas
+        if n not in virtuales and not any(n.startswith(v + "_") for v in virtuales)
+    ]
+
+
+def _columnas(conn, tabla):
+    return [r[1] for r in conn.execute(f'PRAGMA table_info("{tabla}")')]
+
+
+def _consulta(conn, tabla, desde, hasta):
+    sql, params = f'SELECT * FROM "{tabla}"', []
+    if (desde or hasta) and "creado_en" in _columnas(conn, tabla):
+        clauses = []
+        if desde:
+            clauses.append("date(creado_en) >= ?")
+            params.append(desde)
+        if hasta:
+            clauses.append("date(creado_en) <= ?")
+            params.append(hasta)
+        sql += " WHERE " + " AND ".join(clauses)
+    return sql, params
+
+
+# -----------------------
+# Escritores por formato
+# -----------------------
+def _literal_sql(v):
+    if v is None:
+        return "NULL"
+    if isinstance(v, (int, float)):
+        return repr(v)
+    if isinstance(v, bytes):
+        return f"X'{v.hex()}'"
+    return "'" + str(v).replace("'", "''") + "'"
+
+
+class _Texto:
+    """Mismo formato que el volcado anterior: encabezado por tabla y una tupla por línea."""
+
+    def __init__(self, f):
+        self.f = f
+        f.write("Tablas en la base de datos:\n")
+
+    def inicio(self, tabla, columnas, ddl):
+        self.f.write(f"\n===== TABLA: {tabla} =====\n")
+
+    def filas(self, filas):
+        self.f.writelines(f"{fila}\n" for fila in filas)
+
+
+class _Csv:
+    def __init__(self, f):
+        self.escritor = csv.writer(f)
+
+    def inicio(self, tabla, columnas, ddl):
+        self.escritor.writerow(columnas)
+
+    def filas(self, filas):
+        self.escritor.writerows(filas)
+
+
+class _Ndjson:
+    def __init__(self, f):
+        self.f = f
+
+    def inicio(self, tabla, columnas, ddl):
+        self.tabla, self.columnas = tabla, columnas
+
+    def filas(self, filas):
+        for fila in filas:
+            registro = {"_tabla": self.tabla, **dict(zip(self.columnas, fila))}
+            self.f.write(json.dumps(registro, ensure_ascii=False, default=lambda b: b.hex()) + "\n")
+
+
+class _Sql:
+    def __init__(self, f):
+        self.f = f
+        f.write("PRAGMA foreign_keys=OFF;\nBEGIN TRANSACTION;\n")
+
+    def inicio(self, tabla, columnas, ddl):
+        self.tabla = tabla
+        self.f.write(f"{ddl};\n")
+
+    def filas(self, filas):
+        for fila in filas:
+            self.f.write(f'INSERT INTO "{self.tabla}" VALUES({",".join(_literal_sql(v) for v in fila)});\n')
+
+    def cerrar(self, indices):
+        for sql in indices:
+            self.f.write(f"{sql};\n")
+        self.f.write("COMMIT;\n")
+
+
+ESCRITORES = {"texto": _Texto, "csv": _Csv, "ndjson": _Ndjson, "sql": _Sql}
+
+
+def _abrir(ruta, comprimir):
+    if ruta == "-":
+        return gzip.open(sys.stdout.buffer, "wt", encoding="utf-8") if comprimir else sys.stdout
+    if comprimir:
+        return gzip.open(ruta, "wt", encoding="utf-8", newline="", compresslevel=6)
+    return open(ruta, "w", encoding="utf-8", newline="")
+
+
+def _ruta_tabla(ruta, tabla):
+    """pines.csv(.gz) -> pines.<tabla>.csv(.gz)"""
+    base, ext = ruta, ""
+    if base.endswith(".gz"):
+        base, ext = base[:-3], ".gz"
+    base, ext_csv = os.path.splitext(base)
+    return f"{base}.{tabla}{ext_csv or '.csv'}{ext}"
+
+
+# -----------------------
+# Volcado
+# -----------------------
+class _Progreso:
+    def __init__(self, activo):
+        self.activo = activo
+
+    def tabla(self, tabla, total):
+        self.nombre, self.total, self.hechas = tabla, total, 0
+        self.inicio = self.ultimo = time.perf_counter()
+        self._mostrar(final=False)
+
+    def avanzar(self, n):
+        self.hechas += n
+        ahora = time.perf_counter()
+        if ahora - self.ultimo >= 0.5:
+            self.ultimo = ahora
+            self._mostrar(final=False)
+
+    def terminar(self):
+        self._mostrar(final=True)
+
+    def _mostrar(self, final):
+        if not self.activo:
+            return
+        seg = time.perf_counter() - self.inicio
+        pct = f" ({self.hechas / self.total:.0%})" if self.total else ""
+        tasa = f", {self.hechas / seg:,.0f} filas/s" if seg > 0 and self.hechas else ""
+        sys.stderr.write(f"\r{self.nombre}: {self.hechas:,}/{self.total:,}{pct}{tasa}   ")
+        if final:
+            sys.stderr.write("\n")
+        sys.stderr.flush()
+
+
+def _particiones(conn, tabla, desde, hasta):
+    """Archivos de archivo/ con filas de `tabla` que pueden caer en el rango."""
+    if tabla not in particiones.TABLAS:
+        return []
+    return [archivo for _, archivo in particiones.particiones_en_rango(conn, desde, hasta)]
+
+
+def volcar(db_path=DB_PATH, salida="pines_export.txt", formato="texto", tablas=None,
+           desde=None, hasta=None, comprimir=False, lote=TAM_LOTE, progreso=True,
+           incluir_archivo=True):
+    """Vuelca las tablas pedidas. Devuelve {tabla: filas escritas}."""
+    if formato not in ESCRITORES:
+        raise ValueError(f"Formato inválido: {formato}")
+    avance = _Progreso(progreso and salida != "-")
+    conteo = {}
+
+    with lectura.conexion(db_path, retraso_max=0) as conn:
+        conn.row_factory = None
+        disponibles = tablas_disponibles(conn)
+        tablas = tablas or disponibles
+        faltan = [t for t in tablas if t not in disponibles]
+        if faltan:
+            raise ValueError(f"No existen las tablas: {', '.join(faltan)}")
+
+        por_tabla = formato == "csv" and len(tablas) > 1 and salida != "-"
+        f = None if por_tabla else _abrir(salida, comprimir)
+        escritor = None if por_tabla else ESCRITORES[formato](f)
+        try:
+            for tabla in tablas:
+                if por_tabla:
+                    f = _abrir(_ruta_tabla(salida, tabla), comprimir)
+                    escritor = ESCRITORES[formato](f)
+
+                sql, params = _consulta(conn, tabla, desde, hasta)
+                archivos = _particiones(conn, tabla, desde, hasta)
+                if archivos and not incluir_archivo:
+                    sys.stderr.write(
+                        f"Aviso: {tabla} tiene filas archivadas en el rango que no se incluyen: "
+                        f"{', '.join(archivos)}\n"
+                    )
+                    archivos = []
+                # Las particiones guardan ids anteriores a los de la base viva
+                fuentes = [particiones._conectar_solo_lectura(a) for a in archivos] + [conn]
+                try:
+                    for fuente in fuentes:
+                        fuente.row_factory = None
+                    total = sum(
+                        f.execute(f"SELECT count(*) FROM ({sql})", params).fetchone()[0] for f in fuentes
+                    ) if avance.activo else 0
+                    ddl = conn.execute(
+                        "SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (tabla,)
+                    ).fetchone()[0]
+                    escritor.inicio(tabla, _columnas(conn, tabla), ddl)
+                    avance.tabla(tabla, total)
+
+                    for fuente in fuentes:
+                        cur = fuente.execute(sql, params)
+                        while True:
+                            filas = cur.fetchmany(lote)
+                            if not filas:
+                                break
+                            escritor.filas(filas)
+                            avance.avanzar(len(filas))
+                finally:
+                    for fuente in fuentes[:-1]:
+                        fuente.close()
+                avance.terminar()
+                conteo[tabla] = avance.hechas
+
+                if por_tabla:
+                    f.close()
+
+            if formato == "sql":
+                indices = [
+                    sql for (sql,) in conn.execute(
+                        f"SELECT sql FROM sqlite_master WHERE type='index' AND sql IS NOT NULL "
+                        f"AND tbl_name IN ({','.join('?' * len(tablas))})",
+                        tablas,
+                    )
+                ]
+                escritor.cerrar(indices)
+        finally:
+            if f is not None and f is not sys.stdout and not f.closed:
+                f.close()
+            elif f is sys.stdout:
+                f.flush()
+    return conteo
+
+
+def _fecha(texto):
+    try:
+        return date.fromisoformat(texto).isoformat()
+    except ValueError:
+        raise argparse.ArgumentTypeError("fecha inválida (YYYY-MM-DD)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Volcado de tablas de pines.db")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("-t", "--tabla", action="append", dest="tablas",
+                        help="Tabla a volcar (se puede repetir; por defecto todas)")
+    parser.add_argument("-f", "--formato", choices=FORMATOS, default="texto")
+    parser.add_argument("-o", "--salida", help="Archivo de salida ('-' para la consola)")
+    parser.add_argument("--desde", type=_fecha, help="YYYY-MM-DD, sobre creado_en")
+    parser.add_argument("--hasta", type=_fecha, help="YYYY-MM-DD, sobre creado_en")
+    parser.add_argument("--gzip", action="store_true", help="Comprimir la salida")
+    parser.add_argument("--lote", type=int, default=TAM_LOTE, help="Filas por fetchmany")
+    parser.add_argument("-q", "--silencioso", action="store_true", help="Sin progreso en stderr")
+    parser.add_argument("--solo-viva", action="store_true",
+                        help="No incluir las filas archivadas en archivo/*.db")
+    args = parser.parse_args(argv)
+
+    salida = args.salida or "pines_export" + EXTENSIONES[args.formato]
+    if args.gzip and salida != "-" and not salida.endswith(".gz"):
+        salida += ".gz"
+
+    try:
+        conteo = volcar(
+            args.db, salida, args.formato, args.tablas, args.desde, args.hasta,
+            args.gzip, args.lote, not args.silencioso, not args.solo_viva,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    except BrokenPipeError:
+        if salida != "-":
+            raise
+        # El lector cerró la tubería (`| head`): se termina sin traceback. La
+        # consola se redirige a /dev/null para que Python no vuelva a fallar
+        # al vaciarla antes de salir.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+
+    if salida == "-":
+        return
+    if args.formato == "csv" and len(conteo) > 1:
+        for tabla, n in conteo.items():
+            print(f"Exportación completada: {_ruta_tabla(salida, tabla)} ({n:,} filas)", file=sys.stderr)
+    else:
+        print(f"Exportación completada: {salida} ({sum(conteo.values()):,} filas)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
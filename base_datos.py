@@ -1,22 +1,26 @@
-import sqlite3
 import pandas as pd
 from io import BytesIO
 
-def exportar_base_datos_excel():
-    conn = sqlite3.connect("pines.db")
+import lectura
 
+def exportar_base_datos_excel():
     output = BytesIO()
 
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+    # Foto de lectura: no bloquea los pines que se guardan mientras tanto.
+    # Sólo cubre las lecturas; el Excel se escribe ya con la foto cerrada.
+    hojas = {}
+    with lectura.conexion() as conn:
         tablas = conn.execute(
             "SELECT name FROM sqlite_master WHERE type='table';"
         ).fetchall()
 
         for (tabla,) in tablas:
-            df = pd.read_sql_query(f"SELECT * FROM {tabla}", conn)
+            hojas[tabla] = pd.read_sql_query(f"SELECT * FROM {tabla}", conn)
+
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        for tabla, df in hojas.items():
             df.to_excel(writer, sheet_name=tabla, index=False)
 
-    conn.close()
     output.seek(0)
 
     return output
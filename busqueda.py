@@ -0,0 +1,184 @@
+"""
+Búsqueda de texto sobre los atributos de las capas subidas.
+
+Al subir una capa, cada elemento se guarda en `capas_elementos` (capa,
+etiqueta, propiedades en JSON, bbox y centro en WGS84) y el texto de sus
+propiedades en la tabla FTS5 `capas_fts`, con el mismo rowid. Así
+/api/layers/search encuentra calles, colonias o estaciones sin que el
+navegador descargue el GeoJSON de cada capa.
+
+El tokenizador ignora acentos y mayúsculas ("Azcapotzalco" = "azcapotzalco",
+"Estación" = "estacion") y cada palabra buscada se usa como prefijo.
+
+Para reindexar todas las capas desde sus archivos:
+    python busqueda.py reindexar
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+
+import numpy as np
+
+import proyecciones
+
+BASE_DIR = os.path.dirname(__file__)
+DB_PATH = os.path.join(BASE_DIR, "pines.db")
+LAYERS_DIR = os.path.join(BASE_DIR, "static", "layers")
+
+# Campos que se prefieren como etiqueta del resultado (sin importar mayúsculas)
+CAMPOS_ETIQUETA = ("nombre", "nom", "name", "nomgeo", "nom_col", "colonia", "calle", "estacion")
+LIMITE_MAX = 100
+
+
+def crear_tablas(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS capas_elementos (
+            id INTEGER PRIMARY KEY,
+            capa TEXT NOT NULL,
+            indice INTEGER NOT NULL,
+            etiqueta TEXT,
+            propiedades TEXT NOT NULL,
+            min_lon REAL, min_lat REAL, max_lon REAL, max_lat REAL,
+            lon REAL, lat REAL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_capas_elementos_capa ON capas_elementos(capa)")
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS capas_fts USING fts5(
+            texto, tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+
+
+# -----------------------
+# Indexado
+# -----------------------
+def _etiqueta(props):
+    por_nombre = {k.lower(): v for k, v in props.items()}
+    for campo in CAMPOS_ETIQUETA:
+        v = por_nombre.get(campo)
+        if isinstance(v, str) and v.strip():
+            return v.strip()
+    for v in props.values():
+        if isinstance(v, str) and v.strip():
+            return v.strip()
+    return None
+
+
+def _caja(geometria):
+    """(min_lon, min_lat, max_lon, max_lat, lon, lat) o None si no hay coordenadas."""
+    if not geometria or not geometria.get("coordinates"):
+        return None
+    xs, ys = [], []
+    proyecciones._aplanar(geometria["coordinates"], xs, ys)
+    x, y = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+    min_x, min_y, max_x, max_y = x.min(), y.min(), x.max(), y.max()
+    return min_x, min_y, max_x, max_y, (min_x + max_x) / 2, (min_y + max_y) / 2
+
+
+def descartar(db, capa):
+    """Quita del índice los elementos de `capa`. Sin commit."""
+    db.execute(
+        "DELETE FROM capas_fts WHERE rowid IN (SELECT id FROM capas_elementos WHERE capa=?)", (capa,)
+    )
+    db.execute("DELETE FROM capas_elementos WHERE capa=?", (capa,))
+
+
+def indexar_capa(db, capa, features):
+    """Reemplaza los elementos de `capa` (filename del GeoJSON) en el índice. Sin commit."""
+    descartar(db, capa)
+    for i, feat in enumerate(features):
+        props = feat.get("properties") or {}
+        texto = " ".join(str(v) for v in props.values() if v not in (None, ""))
+        caja = _caja(feat.get("geometry")) or (None,) * 6
+        cur = db.execute(
+            """
+            INSERT INTO capas_elementos
+                (capa, indice, etiqueta, propiedades, min_lon, min_lat, max_lon, max_lat, lon, lat)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (capa, i, _etiqueta(props), json.dumps(props, ensure_ascii=False, default=str),
+             *(None if v is None else float(v) for v in caja)),
+        )
+        if texto:
+            db.execute("INSERT INTO capas_fts (rowid, texto) VALUES (?, ?)", (cur.lastrowid, texto))
+
+
+def indexar_archivo(db, capa):
+    with open(os.path.join(LAYERS_DIR, capa), encoding="utf-8") as f:
+        indexar_capa(db, capa, json.load(f).get("features", []))
+
+
+def indexar_faltantes(db):
+    """Indexa las capas registradas que aún no están en el índice (capas previas)."""
+    faltantes = db.execute(
+        """
+        SELECT filename FROM layers
+        WHERE filename NOT IN (SELECT DISTINCT capa FROM capas_elementos)
+        """
+    ).fetchall()
+    for (capa,) in faltantes:
+        if os.path.exists(os.path.join(LAYERS_DIR, capa)):
+            indexar_archivo(db, capa)
+
+
+# -----------------------
+# Consulta
+# -----------------------
+def consulta_fts(q):
+    """Texto libre -> consulta FTS5 segura: cada palabra entre comillas y como prefijo."""
+    palabras = re.findall(r"\w+", q or "")
+    return " ".join(f'"{p}"*' for p in palabras)
+
+
+def buscar(db, q, capa=None, limite=20):
+    expr = consulta_fts(q)
+    if not expr:
+        return []
+    sql = """
+        SELECT e.capa, l.name AS nombre_capa, e.indice, e.etiqueta, e.propiedades,
+               e.min_lon, e.min_lat, e.max_lon, e.max_lat, e.lon, e.lat
+        FROM capas_fts
+        JOIN capas_elementos e ON e.id = capas_fts.rowid
+        JOIN layers l ON l.filename = e.capa
+        WHERE capas_fts MATCH ?
+    """
+    params = [expr]
+    if capa:
+        sql += " AND e.capa = ?"
+        params.append(capa)
+    sql += " ORDER BY capas_fts.rank LIMIT ?"
+    params.append(min(int(limite), LIMITE_MAX))
+
+    resultados = []
+    for r in db.execute(sql, params):
+        resultados.append({
+            "capa": r["capa"],
+            "nombre_capa": r["nombre_capa"],
+            "indice": r["indice"],
+            "etiqueta": r["etiqueta"],
+            "propiedades": json.loads(r["propiedades"]),
+            "bbox": None if r["min_lon"] is None else [r["min_lon"], r["min_lat"], r["max_lon"], r["max_lat"]],
+            "centro": None if r["lon"] is None else [r["lon"], r["lat"]],
+        })
+    return resultados
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Índice de búsqueda de las capas")
+    parser.add_argument("--db", default=DB_PATH)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("reindexar")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    crear_tablas(conn)
+    for (capa,) in conn.execute("SELECT filename FROM layers").fetchall():
+        if os.path.exists(os.path.join(LAYERS_DIR, capa)):
+            indexar_archivo(conn, capa)
+            print(f"Indexada {capa}")
+    conn.commit()
+    conn.close()
@@ -0,0 +1,186 @@
+"""
+Caché en disco de los resultados de /api/pins y /exportar/excel.
+
+La llave es el conjunto de filtros ya normalizado (rango de fechas
+desde/hasta, formato, capa...), así `?month=2025-11` y
+`?start=2025-11-01&end=2025-11-30` comparten resultado.
+
+- Rangos cerrados (terminan antes de hoy): ningún pin nuevo puede caer en
+  ellos, la llave no lleva versión y el resultado sirve mientras no se
+  desaloje.
+- Rangos abiertos: la llave incluye `escrituras.version` de pines.db, que
+  add_pin / add_pins_bulk incrementan en la misma transacción que el pin.
+  Un pin nuevo cambia la llave y el resultado anterior ya no se usa.
+- Una importación histórica o una restauración sí cambian periodos
+  cerrados: llaman a `invalidar_todo()`.
+
+Los resultados son archivos en cache/ y el índice (tamaño, último uso) es
+cache/indice.db, compartido por todos los workers. Al pasar de
+CACHE_MAX_MB se borran los menos usados recientemente.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+
+BASE_DIR = os.path.dirname(__file__)
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+
+MAX_BYTES = int(float(os.environ.get("CACHE_MAX_MB", 512)) * 2**20)
+
+
+# -----------------------
+# Contador de escrituras (en pines.db)
+# -----------------------
+def crear_tablas(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS escrituras (
+            id INTEGER PRIMARY KEY CHECK(id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO escrituras (id) VALUES (1)")
+
+
+# Upsert: también funciona si la fila de la versión aún no existe
+_INCREMENTAR = """
+    INSERT INTO escrituras (id, version) VALUES (1, 1)
+    ON CONFLICT (id) DO UPDATE SET version = version + 1
+"""
+
+
+def _sin_tabla(e):
+    return "no such table" in str(e)
+
+
+def registrar_escritura(db):
+    """Llamar en la misma transacción que inserta pines. Sin commit."""
+    try:
+        db.execute(_INCREMENTAR)
+    except sqlite3.OperationalError as e:
+        # Base anterior a esta tabla: se crea en la misma transacción
+        if not _sin_tabla(e):
+            raise
+        crear_tablas(db)
+        db.execute(_INCREMENTAR)
+
+
+def version(db):
+    """Versión de escrituras; 0 si la base aún no tiene la tabla (o es de sólo lectura)."""
+    try:
+        row = db.execute("SELECT version FROM escrituras WHERE id = 1").fetchone()
+    except sqlite3.OperationalError as e:
+        if not _sin_tabla(e):
+            raise
+        return 0
+    return row[0] if row else 0
+
+
+def cerrado(hasta):
+    """True si el rango termina antes de hoy (ya no recibe pines)."""
+    return bool(hasta) and hasta < date.today().isoformat()
+
+
+# -----------------------
+# Almacén
+# -----------------------
+class CacheResultados:
+    def __init__(self, directorio=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        os.makedirs(directorio, exist_ok=True)
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS entradas (
+                clave TEXT PRIMARY KEY,
+                mimetype TEXT NOT NULL,
+                bytes INTEGER NOT NULL,
+                ultimo_uso REAL NOT NULL
+            )
+        """)
+        self._conn().execute("CREATE INDEX IF NOT EXISTS idx_entradas_uso ON entradas(ultimo_uso)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.directorio, "indice.db"), timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def clave(*partes):
+        return hashlib.sha256(json.dumps(partes, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, clave[:2], clave)
+
+    def obtener(self, clave):
+        """(datos, mimetype) o None."""
+        conn = self._conn()
+        row = conn.execute("SELECT mimetype FROM entradas WHERE clave=?", (clave,)).fetchone()
+        if not row:
+            return None
+        try:
+            with open(self._ruta(clave), "rb") as f:
+                datos = f.read()
+        except FileNotFoundError:
+            # Otro worker la desalojó entre la consulta y la lectura
+            conn.execute("DELETE FROM entradas WHERE clave=?", (clave,))
+            return None
+        conn.execute("UPDATE entradas SET ultimo_uso=? WHERE clave=?", (time.time(), clave))
+        return datos, row[0]
+
+    def guardar(self, clave, datos, mimetype):
+        if len(datos) > self.max_bytes:
+            return
+        ruta = self._ruta(clave)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(datos)
+        os.replace(tmp, ruta)
+        self._conn().execute(
+            "INSERT OR REPLACE INTO entradas (clave, mimetype, bytes, ultimo_uso) VALUES (?, ?, ?, ?)",
+            (clave, mimetype, len(datos), time.time()),
+        )
+        self._desalojar()
+
+    def _desalojar(self):
+        """Borra las entradas menos usadas hasta quedar bajo max_bytes."""
+        conn = self._conn()
+        total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM entradas").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        borrar = []
+        try:
+            for clave, n in conn.execute("SELECT clave, bytes FROM entradas ORDER BY ultimo_uso").fetchall():
+                if total <= self.max_bytes:
+                    break
+                borrar.append(clave)
+                total -= n
+            conn.executemany("DELETE FROM entradas WHERE clave=?", [(c,) for c in borrar])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        for c in borrar:
+            try:
+                os.remove(self._ruta(c))
+            except FileNotFoundError:
+                pass
+
+    def invalidar_todo(self):
+        conn = self._conn()
+        claves = [c for (c,) in conn.execute("SELECT clave FROM entradas").fetchall()]
+        conn.execute("DELETE FROM entradas")
+        for c in claves:
+            try:
+                os.remove(self._ruta(c))
+            except FileNotFoundError:
+                pass
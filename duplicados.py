@@ -0,0 +1,139 @@
+"""
+Detección de pines duplicados al guardarlos.
+
+Un pin se considera duplicado si ya existe otro de la misma visita, con el
+mismo `codigo_pin`, a menos de RADIO_M metros y guardado hace menos de
+VENTANA_S segundos (reenvíos por mala conexión, varios toques en el mismo
+lugar). Los duplicados no se guardan; la respuesta indica cuáles fueron.
+
+Para no recorrer la tabla, `pines` tiene un índice por expresión sobre
+(visita_id, codigo_pin, celda de latitud, celda de longitud), con celdas de
+CELDA_GRADOS. Cada revisión es una búsqueda en el índice sobre las celdas
+vecinas, seguida de la distancia exacta.
+
+Las peticiones a /api/pins/bulk pueden traer una llave de idempotencia
+(encabezado `Idempotency-Key` o campo `idempotency_key`). Si la misma llave
+vuelve a llegar, se devuelve la respuesta original sin guardar nada.
+"""
+import json
+import math
+import os
+from datetime import datetime, timedelta
+
+RADIO_M = float(os.environ.get("DUPLICADOS_RADIO_M", 5))
+VENTANA_S = int(os.environ.get("DUPLICADOS_VENTANA_S", 120))
+# Horas que se guardan las llaves de idempotencia
+RETENCION_LLAVES_H = 24
+
+# ~11 m de latitud y ~10.5 m de longitud en la Ciudad de México.
+# Es parte del índice: si cambia hay que borrar idx_pines_celda.
+CELDA_GRADOS = 0.0001
+_CELDA_LAT = f"CAST(lat / {CELDA_GRADOS} AS INTEGER)"
+_CELDA_LON = f"CAST(lon / {CELDA_GRADOS} AS INTEGER)"
+
+_RADIO_TIERRA_M = 6_371_008.8
+
+
+def crear_tablas(conn):
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_pines_celda ON pines(visita_id, codigo_pin, {_CELDA_LAT}, {_CELDA_LON})"
+    )
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS idempotencia (
+            llave TEXT PRIMARY KEY,
+            visita_id INTEGER NOT NULL,
+            respuesta TEXT,
+            creado_en TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotencia_creado ON idempotencia(creado_en)")
+
+
+def celda(lat, lon):
+    # Igual que CAST(... AS INTEGER) en SQLite: trunca hacia cero
+    return int(lat / CELDA_GRADOS), int(lon / CELDA_GRADOS)
+
+
+def distancia_m(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * _RADIO_TIERRA_M * math.asin(math.sqrt(a))
+
+
+def _vecinos():
+    # Celdas a revisar alrededor de la del pin; con truncado hacia cero una
+    # celda mide al menos CELDA_GRADOS, así que basta con este margen
+    metros_por_grado = 111_320 * math.cos(math.radians(19.5))
+    return max(1, math.ceil(RADIO_M / (CELDA_GRADOS * metros_por_grado)))
+
+
+class Filtro:
+    """
+    Revisa los pines de una petición contra la base y entre sí. Úsese con
+    la escritura de la petición ya en curso para que dos peticiones
+    simultáneas no dejen pasar el mismo pin.
+    """
+
+    def __init__(self, db, ahora=None):
+        self.db = db
+        self.ahora = ahora or datetime.now()
+        self.desde = (self.ahora - timedelta(seconds=VENTANA_S)).isoformat(timespec="seconds")
+        self.k = _vecinos()
+        self.sql = f"""
+            SELECT id, lat, lon FROM pines
+            WHERE visita_id = ? AND codigo_pin = ?
+              AND {_CELDA_LAT} BETWEEN ? AND ?
+              AND {_CELDA_LON} BETWEEN ? AND ?
+              AND creado_en >= ?
+        """
+        # Pines aceptados en esta misma petición: (visita, codigo, celda) -> [(lat, lon)]
+        self._aceptados = {}
+
+    def duplicado_de(self, visita_id, codigo_pin, lat, lon):
+        """id del pin existente que duplica a este, -1 si es repetido dentro de la petición, o None."""
+        cy, cx = celda(lat, lon)
+        k = self.k
+        for row in self.db.execute(
+            self.sql, (visita_id, codigo_pin, cy - k, cy + k, cx - k, cx + k, self.desde)
+        ):
+            if distancia_m(lat, lon, row[1], row[2]) <= RADIO_M:
+                return row[0]
+        for dy in range(-k, k + 1):
+            for dx in range(-k, k + 1):
+                for plat, plon in self._aceptados.get((visita_id, codigo_pin, cy + dy, cx + dx), ()):
+                    if distancia_m(lat, lon, plat, plon) <= RADIO_M:
+                        return -1
+        self._aceptados.setdefault((visita_id, codigo_pin, cy, cx), []).append((lat, lon))
+        return None
+
+
+# -----------------------
+# Llaves de idempotencia
+# -----------------------
+def reservar_llave(db, llave, visita_id):
+    """
+    Registra la llave dentro de la transacción actual. Devuelve None si es
+    nueva o la respuesta guardada (dict) si ya se había usado; ValueError
+    si la llave es de otra visita. Insertarla toma el candado de escritura,
+    así que un reintento simultáneo espera a que termine la petición original.
+    """
+    ahora = datetime.now()
+    cur = db.execute(
+        "INSERT OR IGNORE INTO idempotencia (llave, visita_id, creado_en) VALUES (?, ?, ?)",
+        (llave, visita_id, ahora.isoformat(timespec="seconds")),
+    )
+    if cur.rowcount == 1:
+        limite = (ahora - timedelta(hours=RETENCION_LLAVES_H)).isoformat(timespec="seconds")
+        db.execute("DELETE FROM idempotencia WHERE creado_en < ?", (limite,))
+        return None
+    row = db.execute(
+        "SELECT visita_id, respuesta FROM idempotencia WHERE llave=?", (llave,)
+    ).fetchone()
+    if row[0] != visita_id:
+        raise ValueError("La llave de idempotencia pertenece a otra visita.")
+    return json.loads(row[1]) if row[1] else {"ok": True}
+
+
+def guardar_respuesta(db, llave, respuesta):
+    db.execute("UPDATE idempotencia SET respuesta=? WHERE llave=?", (json.dumps(respuesta), llave))
@@ -0,0 +1,533 @@
+"""
+Importación masiva de visitas y pines históricos desde CSV/XLSX.
+
+Lee el archivo por bloques (chunks), valida contra `catalogo_pines`, calcula
+`dentro_malla` de todo el bloque con numpy y guarda con `executemany` dentro
+de transacciones grandes. Cada lote (por defecto el hash del archivo) guarda
+cuántas filas ya se procesaron, así que volver a correr la misma importación
+no duplica datos y una importación interrumpida continúa donde se quedó.
+
+Formatos aceptados:
+  - XLSX con hojas `visitas` y/o `pines` (como los export_bd_*.xlsx).
+  - CSV con las columnas de una sola tabla (se detecta por `codigo_pin`).
+
+Los pines se enlazan sólo con visitas importadas en el mismo lote: un pin
+cuyo `visita_id` no está en el lote se rechaza.
+
+Si el archivo trae al menos tantas filas como ya tiene la tabla (y más de
+MIN_FILAS_DIFERIR), los índices no únicos de esa tabla se quitan durante la
+carga y se reconstruyen al final (ver `diferir_indices`).
+
+Uso desde consola:
+    python importacion.py export_bd_20260120_165724.xlsx
+    python importacion.py visitas.csv --lote ronda_2024
+    python importacion.py pines.csv --lote ronda_2024
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import cache_resultados
+import od
+
+BASE_DIR = os.path.dirname(__file__)
+DB_PATH = os.path.join(BASE_DIR, "pines.db")
+POLYGON_PATH = os.path.join(BASE_DIR, "static", "layers", "Entorno_Urbano_UAM_A.json")
+
+TAM_BLOQUE = 50_000
+# Bloques que se confirman juntos en una misma transacción
+BLOQUES_POR_TRANSACCION = 10
+# Filas mínimas de una importación para quitar los índices no únicos de la
+# tabla mientras se carga (sólo si además trae al menos tantas filas como
+# ya tiene la tabla: reconstruir un índice cuesta según el total de filas)
+MIN_FILAS_DIFERIR = 50_000
+
+def crear_tablas(conn):
+    """Tablas de control de importaciones (avance por lote y mapeo de visitas)."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS importaciones (
+            lote TEXT NOT NULL,
+            tabla TEXT NOT NULL,
+            filas_procesadas INTEGER NOT NULL DEFAULT 0,
+            insertadas INTEGER NOT NULL DEFAULT 0,
+            rechazadas INTEGER NOT NULL DEFAULT 0,
+            actualizado_en TEXT NOT NULL,
+            PRIMARY KEY (lote, tabla)
+        )
+    """)
+    # id de la visita en el archivo -> id asignado en esta base, por tramos:
+    # id_origen + k -> id_local + k para k en [0, n). Un export ordenado por
+    # id ocupa una fila por bloque en lugar de una por visita.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS importaciones_visitas (
+            lote TEXT NOT NULL,
+            id_origen INTEGER NOT NULL,
+            id_local INTEGER NOT NULL,
+            n INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (lote, id_local)
+        ) WITHOUT ROWID
+    """)
+    columnas = [r[1] for r in conn.execute("PRAGMA table_info(importaciones_visitas)")]
+    if "n" not in columnas:
+        # Mapeo anterior, una fila por visita: cada fila es un tramo de 1
+        conn.execute("ALTER TABLE importaciones_visitas RENAME TO importaciones_visitas_ant")
+        crear_tablas(conn)
+        conn.execute("""
+            INSERT INTO importaciones_visitas (lote, id_origen, id_local, n)
+            SELECT lote, id_origen, id_local, 1 FROM importaciones_visitas_ant
+        """)
+        conn.execute("DROP TABLE importaciones_visitas_ant")
+        return
+    # Índices quitados durante una importación grande; se restauran al
+    # terminar o, si el proceso murió a medias, al empezar la siguiente
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS importaciones_indices (
+            nombre TEXT PRIMARY KEY,
+            sql TEXT NOT NULL
+        )
+    """)
+
+
+# -----------------------
+# Malla (polígono de referencia)
+# -----------------------
+def cargar_malla(path=POLYGON_PATH):
+    with open(path) as f:
+        data = json.load(f)
+    return data["features"][0]["geometry"]["coordinates"][0]
+
+
+def puntos_en_poligono(lat, lon, polygon):
+    """
+    Versión vectorizada de `point_in_polygon` (mismo criterio de bordes):
+    recorre las aristas una vez y evalúa todos los puntos a la vez.
+    """
+    x = np.asarray(lon, dtype=float)
+    y = np.asarray(lat, dtype=float)
+    inside = np.zeros(x.shape, dtype=bool)
+
+    poly = np.asarray(polygon, dtype=float)[:, :2]
+    p1 = poly
+    p2 = np.roll(poly, -1, axis=0)
+    for (p1x, p1y), (p2x, p2y) in zip(p1, p2):
+        if p1y == p2y:
+            # Arista horizontal: nunca cumple y > min y y <= max a la vez
+            continue
+        cruza = (y > min(p1y, p2y)) & (y <= max(p1y, p2y)) & (x <= max(p1x, p2x))
+        if p1x != p2x:
+            xinters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
+            cruza &= x <= xinters
+        inside ^= cruza
+
+    return inside
+
+
+# -----------------------
+# Lectura por bloques
+# -----------------------
+def hash_archivo(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def tablas_en_archivo(path, tabla=None):
+    """Tablas a importar del archivo, en orden (visitas antes que pines)."""
+    if path.lower().endswith(".xlsx"):
+        from openpyxl import load_workbook
+
+        wb = load_workbook(path, read_only=True)
+        hojas = set(wb.sheetnames)
+        wb.close()
+        return [t for t in ("visitas", "pines") if t in hojas and (tabla in (None, t))]
+
+    if tabla:
+        return [tabla]
+    encabezado = pd.read_csv(path, nrows=0).columns
+    return ["pines" if "codigo_pin" in encabezado else "visitas"]
+
+
+def leer_bloques(path, tabla, saltar=0, tam=TAM_BLOQUE):
+    """Genera DataFrames de hasta `tam` filas, omitiendo las primeras `saltar`."""
+    if not path.lower().endswith(".xlsx"):
+        yield from pd.read_csv(
+            path, chunksize=tam, skiprows=range(1, saltar + 1), dtype={"idu": object}
+        )
+        return
+
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True)
+    try:
+        filas = wb[tabla].iter_rows(values_only=True)
+        encabezado = [str(c) for c in next(filas, ())]
+        for _ in range(saltar):
+            if next(filas, None) is None:
+                return
+        bloque = []
+        for fila in filas:
+            bloque.append(fila)
+            if len(bloque) == tam:
+                yield pd.DataFrame(bloque, columns=encabezado)
+                bloque = []
+        if bloque:
+            yield pd.DataFrame(bloque, columns=encabezado)
+    finally:
+        wb.close()
+
+
+# -----------------------
+# Preparación de bloques
+# -----------------------
+def _fechas(serie):
+    fechas = pd.to_datetime(serie, errors="coerce", format="ISO8601")
+    # numpy da el mismo formato que isoformat(timespec="seconds") sin strftime fila por fila
+    texto = pd.Series(fechas.to_numpy().astype("datetime64[s]").astype(str), index=serie.index)
+    return fechas, texto
+
+
+def _limpiar(valor):
+    texto = str(valor).strip()
+    return texto or None
+
+
+def _texto(df, col):
+    if col not in df:
+        return pd.Series([None] * len(df), index=df.index, dtype=object)
+    # Códigos, lugares y rutas se repiten: cada valor distinto se limpia una vez
+    codigos, unicos = pd.factorize(df[col])
+    limpios = np.array([_limpiar(v) for v in unicos] + [None], dtype=object)
+    return pd.Series(limpios[codigos], index=df.index)
+
+
+def _validar_columnas(df, tabla):
+    requeridas = {"visitas": {"creado_en"}, "pines": {"visita_id", "codigo_pin", "lat", "lon", "creado_en"}}
+    faltan = requeridas[tabla] - set(df.columns)
+    if faltan:
+        raise ValueError(f"Faltan columnas en {tabla}: {', '.join(sorted(faltan))}")
+
+
+def _ids_origen(df, offset):
+    if "id" in df:
+        return pd.to_numeric(df["id"], errors="coerce")
+    # Sin columna id: la posición en el archivo es el identificador estable
+    return pd.Series(np.arange(offset, offset + len(df)), index=df.index, dtype=float)
+
+
+def _enteros(serie):
+    """Serie numérica -> lista de int (None donde no hay valor), sin recorrerla en Python."""
+    enteros = np.trunc(serie.to_numpy(dtype=float))
+    valido = np.isfinite(enteros)
+    lista = np.full(len(enteros), None, dtype=object)
+    lista[valido] = enteros[valido].astype(np.int64)
+    return lista.tolist()
+
+
+def preparar_visitas(df, offset):
+    _validar_columnas(df, "visitas")
+    fechas, creado = _fechas(df["creado_en"])
+    ids = _ids_origen(df, offset)
+    edad = pd.to_numeric(df.get("edad"), errors="coerce")
+    validas = fechas.notna() & ids.notna()
+
+    filas = list(zip(
+        _enteros(edad[validas]),
+        _texto(df, "origen")[validas].tolist(),
+        _texto(df, "destino")[validas].tolist(),
+        creado[validas].tolist(),
+    ))
+    return filas, ids[validas].astype(np.int64).to_numpy(), int((~validas).sum())
+
+
+def _visitas_locales(ids, mapa_visitas):
+    """ids del archivo -> ids locales; NaN si la visita no está en el lote."""
+    origen, local = mapa_visitas
+    valores = ids.to_numpy(dtype=float)
+    pos = np.clip(np.searchsorted(origen, valores), 0, len(origen) - 1)
+    encontrada = np.isfinite(valores) & (origen[pos] == valores)
+    return pd.Series(np.where(encontrada, local[pos], np.nan), index=ids.index)
+
+
+def preparar_pines(df, catalogo, mapa_visitas, polygon):
+    _validar_columnas(df, "pines")
+    fechas, creado = _fechas(df["creado_en"])
+    lat = pd.to_numeric(df["lat"], errors="coerce")
+    lon = pd.to_numeric(df["lon"], errors="coerce")
+    codigo = _texto(df, "codigo_pin")
+    visita = _visitas_locales(pd.to_numeric(df["visita_id"], errors="coerce"), mapa_visitas)
+
+    validas = (
+        fechas.notna()
+        & np.isfinite(lat) & np.isfinite(lon)
+        & codigo.isin(catalogo)
+        & visita.notna()
+    )
+
+    lat, lon = lat[validas].to_numpy(), lon[validas].to_numpy()
+    dentro = puntos_en_poligono(lat, lon, polygon).astype(int)
+    filas = list(zip(
+        visita[validas].to_numpy(dtype=np.int64).tolist(),
+        codigo[validas].tolist(),
+        lat.tolist(),
+        lon.tolist(),
+        _texto(df, "nom")[validas].tolist(),
+        _texto(df, "idu")[validas].tolist(),
+        dentro.tolist(),
+        creado[validas].tolist(),
+    ))
+    return filas, int((~validas).sum())
+
+
+# -----------------------
+# Índices diferidos
+# -----------------------
+def _filas_en_archivo(path, tabla):
+    """Filas de datos de `tabla` en el archivo (aprox. en XLSX; 0 si no se sabe)."""
+    if path.lower().endswith(".xlsx"):
+        from openpyxl import load_workbook
+
+        wb = load_workbook(path, read_only=True)
+        try:
+            return max((wb[tabla].max_row or 1) - 1, 0)
+        finally:
+            wb.close()
+    with open(path, "rb") as f:
+        lineas = sum(bloque.count(b"\n") for bloque in iter(lambda: f.read(1 << 20), b""))
+    return max(lineas - 1, 0)
+
+
+def _conviene_diferir(conn, path, tabla, hechas):
+    nuevas = _filas_en_archivo(path, tabla) - hechas
+    existentes = conn.execute(f"SELECT count(*) FROM {tabla}").fetchone()[0]
+    return nuevas >= max(MIN_FILAS_DIFERIR, existentes)
+
+
+def diferir_indices(conn, tabla):
+    """
+    Quita los índices no únicos de `tabla` y los anota en
+    importaciones_indices. Insertar sin ellos y reconstruirlos al final es
+    mucho más rápido que mantenerlos fila por fila; mientras tanto las
+    consultas de la app sobre esa tabla van más lentas.
+    """
+    indices = [
+        (nombre, sql) for nombre, sql in conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL",
+            (tabla,),
+        ).fetchall()
+        if not sql.lstrip().upper().startswith("CREATE UNIQUE")
+    ]
+    conn.execute("BEGIN IMMEDIATE")
+    conn.executemany("INSERT OR REPLACE INTO importaciones_indices (nombre, sql) VALUES (?, ?)", indices)
+    for nombre, _ in indices:
+        conn.execute(f'DROP INDEX "{nombre}"')
+    conn.execute("COMMIT")
+
+
+def restaurar_indices(conn):
+    """Vuelve a crear los índices anotados por diferir_indices."""
+    pendientes = conn.execute("SELECT nombre, sql FROM importaciones_indices").fetchall()
+    if not pendientes:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    for nombre, sql in pendientes:
+        existe = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='index' AND name=?", (nombre,)
+        ).fetchone()
+        if not existe:
+            conn.execute(sql)
+    conn.execute("DELETE FROM importaciones_indices")
+    conn.execute("COMMIT")
+
+
+# -----------------------
+# Importación
+# -----------------------
+def _avance(conn, lote, tabla):
+    row = conn.execute(
+        "SELECT filas_procesadas, insertadas, rechazadas FROM importaciones WHERE lote=? AND tabla=?",
+        (lote, tabla),
+    ).fetchone()
+    return row or (0, 0, 0)
+
+
+def _tramos(ids, primer_local):
+    """
+    ids del archivo (en orden de inserción) -> filas (id_origen, id_local, n)
+    de importaciones_visitas, cortando donde los ids dejan de ser consecutivos.
+    """
+    if not len(ids):
+        return []
+    inicios = np.flatnonzero(np.diff(ids) != 1) + 1
+    inicios = np.concatenate(([0], inicios))
+    n = np.diff(np.concatenate((inicios, [len(ids)])))
+    return list(zip(ids[inicios].tolist(), (primer_local + inicios).tolist(), n.tolist()))
+
+
+def _mapa_visitas(conn, lote):
+    """
+    (ids del archivo ordenados, ids locales) de las visitas importadas en
+    `lote`. Se arma una vez por tabla; los pines de un lote sólo pueden
+    apuntar a visitas de ese mismo lote.
+    """
+    filas = conn.execute(
+        "SELECT id_origen, id_local, n FROM importaciones_visitas WHERE lote=?", (lote,)
+    ).fetchall()
+    if not filas:
+        raise ValueError(
+            f"El lote {lote} no tiene visitas importadas: importa primero las visitas con el mismo --lote"
+        )
+    tramos = np.array(filas, dtype=np.int64)
+    n = tramos[:, 2]
+    k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    origen = np.repeat(tramos[:, 0], n) + k
+    local = np.repeat(tramos[:, 1], n) + k
+    # Un id repetido en el archivo apunta a la última visita insertada con él
+    orden = np.lexsort((local, origen))
+    origen, local = origen[orden], local[orden]
+    ultimo = np.append(origen[1:] != origen[:-1], True)
+    return origen[ultimo], local[ultimo]
+
+
+def importar_archivo(path, db_path=DB_PATH, lote=None, tabla=None,
+                     tam=TAM_BLOQUE, progreso=None):
+    """
+    Importa `path` en la base `db_path`. Devuelve un resumen por tabla con
+    las filas procesadas, insertadas y rechazadas en esta corrida, las
+    omitidas (ya importadas antes) y en `total` lo acumulado por el lote.
+    `progreso(tabla, procesadas, insertadas, rechazadas)` se llama por bloque
+    con los conteos de esta corrida.
+    """
+    lote = lote or hash_archivo(path)
+    polygon = cargar_malla()
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA cache_size = -200000")
+    crear_tablas(conn)
+    od.crear_tablas(conn)
+    cache_resultados.crear_tablas(conn)
+    restaurar_indices(conn)
+    catalogo = {r[0] for r in conn.execute("SELECT codigo FROM catalogo_pines")}
+
+    resumen = {}
+    cambio_pines = False
+    try:
+        for t in tablas_en_archivo(path, tabla):
+            hechas, insertadas_antes, rechazadas_antes = _avance(conn, lote, t)
+            procesadas, insertadas, rechazadas = hechas, insertadas_antes, rechazadas_antes
+            mapa = _mapa_visitas(conn, lote) if t == "pines" else None
+            if _conviene_diferir(conn, path, t, hechas):
+                diferir_indices(conn, t)
+
+            conn.execute("BEGIN IMMEDIATE")
+            for n, df in enumerate(leer_bloques(path, t, saltar=hechas, tam=tam), 1):
+                if t == "visitas":
+                    filas, ids, malas = preparar_visitas(df, procesadas)
+                    conn.executemany(
+                        "INSERT INTO visitas (edad, origen, destino, creado_en) VALUES (?, ?, ?, ?)",
+                        filas,
+                    )
+                    if filas:
+                        # Con la escritura bloqueada los ids nuevos son consecutivos
+                        ultimo = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                        primero = ultimo - len(filas) + 1
+                        conn.executemany(
+                            "INSERT INTO importaciones_visitas (lote, id_origen, id_local, n) VALUES (?, ?, ?, ?)",
+                            [(lote, *tramo) for tramo in _tramos(ids, primero)],
+                        )
+                        od.registrar_visitas_rango(conn, primero, ultimo)
+                else:
+                    filas, malas = preparar_pines(df, catalogo, mapa, polygon)
+                    conn.executemany(
+                        """
+                        INSERT INTO pines (visita_id, codigo_pin, lat, lon, nom, idu, dentro_malla, creado_en)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        """,
+                        filas,
+                    )
+                    if filas:
+                        ultimo = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                        od.registrar_pines(conn, ultimo - len(filas) + 1, ultimo)
+                        cache_resultados.registrar_escritura(conn)
+                        cambio_pines = True
+
+                procesadas += len(df)
+                insertadas += len(filas)
+                rechazadas += malas
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO importaciones
+                        (lote, tabla, filas_procesadas, insertadas, rechazadas, actualizado_en)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (lote, t, procesadas, insertadas, rechazadas,
+                     datetime.now().isoformat(timespec="seconds")),
+                )
+                if n % BLOQUES_POR_TRANSACCION == 0:
+                    conn.execute("COMMIT")
+                    conn.execute("BEGIN IMMEDIATE")
+                if progreso:
+                    progreso(t, procesadas - hechas, insertadas - insertadas_antes, rechazadas - rechazadas_antes)
+            conn.execute("COMMIT")
+            restaurar_indices(conn)
+
+            resumen[t] = {
+                "procesadas": procesadas - hechas,
+                "insertadas": insertadas - insertadas_antes,
+                "rechazadas": rechazadas - rechazadas_antes,
+                "omitidas": hechas,
+                "total": {"procesadas": procesadas, "insertadas": insertadas, "rechazadas": rechazadas},
+            }
+    finally:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        restaurar_indices(conn)
+        conn.close()
+        # Pines históricos pueden caer en periodos cerrados ya guardados en caché
+        if cambio_pines:
+            cache_resultados.CacheResultados().invalidar_todo()
+
+    return {"lote": lote, "tablas": resumen}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa visitas y pines históricos (CSV/XLSX).")
+    parser.add_argument("archivo")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--lote", help="Identificador del lote (por defecto, hash del archivo)")
+    parser.add_argument("--tabla", choices=["visitas", "pines"])
+    parser.add_argument("--bloque", type=int, default=TAM_BLOQUE)
+    args = parser.parse_args(argv)
+
+    inicio = time.perf_counter()
+
+    def progreso(tabla, procesadas, insertadas, rechazadas):
+        seg = max(time.perf_counter() - inicio, 1e-9)
+        print(
+            f"\r{tabla}: {procesadas:,} filas ({insertadas:,} insertadas, "
+            f"{rechazadas:,} rechazadas) {procesadas / seg:,.0f} filas/s",
+            end="", file=sys.stderr, flush=True,
+        )
+
+    try:
+        resumen = importar_archivo(
+            args.archivo, args.db, lote=args.lote, tabla=args.tabla,
+            tam=args.bloque, progreso=progreso,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    print(file=sys.stderr)
+    print(json.dumps(resumen, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
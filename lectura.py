@@ -0,0 +1,215 @@
+"""
+Conexiones de sólo lectura para consultas pesadas (exportaciones, análisis).
+
+Las exportaciones leen toda la base mientras los participantes siguen
+guardando pines. `conexion()` abre una conexión de sólo lectura y una
+transacción de lectura: en modo WAL eso da una foto consistente de la base
+que no bloquea a los escritores ni se ve afectada por ellos. Fuera de WAL
+la misma lectura sí bloquea a los escritores, así que `conexion()` cambia
+la base a WAL si hace falta y avisa si no lo logra. Conviene que el bloque
+`with` sólo lea y que el Excel se escriba después de cerrarlo.
+
+Con LECTURA_RETRASO_MAX_S > 0 (variable de entorno) las lecturas van a una
+réplica en replica/, copiada con la API de backup y renovada cuando tiene
+más de ese número de segundos. Así las lecturas ni siquiera comparten
+archivo con la base viva (el WAL no crece durante exportaciones largas), a
+cambio de datos con hasta ese retraso. Con 0 (por defecto) se lee la base
+viva sin retraso.
+
+Benchmark de latencia de escritura durante una exportación:
+    python lectura.py benchmark
+"""
+import argparse
+import fcntl
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+import warnings
+from contextlib import contextmanager
+from io import BytesIO
+
+import pandas as pd
+
+import respaldo
+
+BASE_DIR = os.path.dirname(__file__)
+DB_PATH = os.path.join(BASE_DIR, "pines.db")
+REPLICA_DIR = os.path.join(BASE_DIR, "replica")
+
+RETRASO_MAX_S = float(os.environ.get("LECTURA_RETRASO_MAX_S", 0))
+
+# Bases ya revisadas por _asegurar_wal en este proceso
+_EN_WAL = set()
+
+
+def _edad(ruta):
+    try:
+        return time.time() - os.path.getmtime(ruta)
+    except FileNotFoundError:
+        return float("inf")
+
+
+def replica(db_path=DB_PATH, retraso_max=RETRASO_MAX_S, replica_dir=REPLICA_DIR):
+    """
+    Ruta de una réplica de `db_path` con a lo más `retraso_max` segundos de
+    antigüedad. Si está vieja, un solo proceso la renueva (candado de
+    archivo) y los demás esperan y usan la nueva.
+    """
+    os.makedirs(replica_dir, exist_ok=True)
+    ruta = os.path.join(replica_dir, os.path.basename(db_path))
+    if _edad(ruta) <= retraso_max:
+        return ruta
+
+    with open(ruta + ".lock", "w") as candado:
+        fcntl.flock(candado, fcntl.LOCK_EX)
+        if _edad(ruta) <= retraso_max:
+            return ruta
+        inicio = time.time()
+        tmp = ruta + ".tmp"
+        respaldo._copiar_en_linea(db_path, tmp)
+        # La réplica no recibe escrituras: sin WAL basta el archivo .db
+        conn = sqlite3.connect(tmp)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+        # La antigüedad se cuenta desde la foto, no desde el fin de la copia
+        os.utime(tmp, (inicio, inicio))
+        # Las conexiones abiertas conservan la réplica anterior
+        os.replace(tmp, ruta)
+    return ruta
+
+
+def _asegurar_wal(db_path):
+    """Pone `db_path` en modo WAL (persistente) o avisa si no se puede."""
+    if db_path in _EN_WAL:
+        return
+    try:
+        conn = sqlite3.connect(db_path, timeout=5)
+        try:
+            modo = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        modo = f"error: {e}"
+    if modo.lower() == "wal":
+        _EN_WAL.add(db_path)
+    else:
+        warnings.warn(
+            f"{db_path} no está en modo WAL ({modo}): las lecturas largas bloquearán a los escritores",
+            RuntimeWarning,
+        )
+
+
+@contextmanager
+def conexion(db_path=DB_PATH, retraso_max=None):
+    """
+    Conexión de sólo lectura con una transacción de lectura abierta durante
+    todo el bloque `with`: todas las consultas ven la misma foto de la base.
+    """
+    retraso_max = RETRASO_MAX_S if retraso_max is None else retraso_max
+    if retraso_max > 0:
+        ruta = replica(db_path, retraso_max)
+    else:
+        _asegurar_wal(db_path)
+        ruta = db_path
+
+    conn = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True, isolation_level=None, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("BEGIN")
+        # La foto se fija con la primera lectura
+        conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.execute("COMMIT")
+        conn.close()
+
+
+# -----------------------
+# Benchmark
+# -----------------------
+def _exportar(conn):
+    """Lectura completa + Excel, como /admin/download."""
+    df = pd.read_sql_query("SELECT * FROM pines", conn)
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        df.to_excel(writer, sheet_name="pines", index=False)
+    return len(df)
+
+
+def _exportar_sin_foto(db_path):
+    """Como antes: conexión normal que mantiene la lectura abierta mientras exporta."""
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+    conn.execute("BEGIN")
+    _exportar(conn)
+    conn.execute("COMMIT")
+    conn.close()
+
+
+def benchmark(filas=200_000, duracion=2.0):
+    """
+    Latencia de los commits de un escritor sin exportación y durante una
+    exportación a Excel: con la base en modo journal y conexión normal, con
+    WAL y foto de lectura, y con réplica.
+    """
+    def resumen(nombre, lat):
+        lat = sorted(lat)
+        p99 = lat[min(len(lat) - 1, int(len(lat) * 0.99))]
+        print(f"{nombre:<30} n={len(lat):>5}  p50={statistics.median(lat):6.2f} ms  "
+              f"p99={p99:7.2f} ms  max={lat[-1]:8.2f} ms")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        conn = sqlite3.connect(db)
+        conn.execute("""
+            CREATE TABLE pines (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, visita_id INTEGER NOT NULL,
+                codigo_pin TEXT NOT NULL, lat REAL NOT NULL, lon REAL NOT NULL,
+                nom TEXT, idu TEXT, dentro_malla INTEGER, creado_en TEXT NOT NULL)
+        """)
+        conn.executemany(
+            "INSERT INTO pines (visita_id, codigo_pin, lat, lon, nom, dentro_malla, creado_en) VALUES (?, 'VIP', 19.5, -99.18, ?, 1, '2025-01-01T00:00:00')",
+            ((i, "/static/img/Sticker Violencia - 01.png") for i in range(filas)),
+        )
+        conn.commit()
+        conn.close()
+        print(f"Base de prueba: {filas:,} pines")
+
+        resumen("journal: sin exportación", respaldo._latencias_escritura(db, duracion))
+        resumen(
+            "journal: exportación",
+            respaldo._latencias_escritura(db, en_paralelo=lambda: _exportar_sin_foto(db)),
+        )
+
+        conn = sqlite3.connect(db)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.close()
+
+        def con_foto(retraso):
+            def exportar():
+                with conexion(db, retraso) as c:
+                    _exportar(c)
+            return exportar
+
+        resumen("WAL: sin exportación", respaldo._latencias_escritura(db, duracion))
+        resumen("WAL: exportación (foto)", respaldo._latencias_escritura(db, en_paralelo=con_foto(0)))
+
+        # Réplica ya copiada: la exportación no toca la base viva
+        ruta = replica(db, 0, os.path.join(tmp, "replica"))
+
+        def con_replica():
+            with conexion(ruta, 0) as c:
+                _exportar(c)
+
+        resumen("WAL: exportación (réplica)", respaldo._latencias_escritura(db, en_paralelo=con_replica))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lecturas con foto consistente de pines.db")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("benchmark")
+    b.add_argument("--filas", type=int, default=200_000)
+    args = parser.parse_args()
+    benchmark(args.filas)
@@ -0,0 +1,313 @@
+"""
+Matriz origen-destino (OD) de las visitas.
+
+Cada visita se registra al guardarse en `od_visitas` con sus llaves ya
+normalizadas (origen/destino sin acentos ni mayúsculas, rango de edad y
+día) y suma 1 en `od_agregado`. Los pines suman en `od_categorias` por
+categoría del catálogo. /api/od sólo lee las tablas agregadas, cuyo tamaño
+depende de días x rangos x pares OD y no del número de visitas.
+
+Para recalcular todo desde cero (incluye las particiones archivadas):
+    python od.py reconstruir
+"""
+import argparse
+import os
+import re
+import sqlite3
+import unicodedata
+from functools import lru_cache
+
+import particiones
+
+BASE_DIR = os.path.dirname(__file__)
+DB_PATH = os.path.join(BASE_DIR, "pines.db")
+
+# (límite inferior, etiqueta); el último no tiene límite superior
+RANGOS_EDAD = [(0, "0-17"), (18, "18-24"), (25, "25-34"), (35, "35-44"), (45, "45-59"), (60, "60+")]
+SIN_DATO = "sin dato"
+
+
+def crear_tablas(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS od_visitas (
+            visita_id INTEGER PRIMARY KEY,
+            dia TEXT NOT NULL,
+            rango_edad TEXT NOT NULL,
+            origen TEXT NOT NULL,
+            destino TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS od_agregado (
+            dia TEXT NOT NULL,
+            rango_edad TEXT NOT NULL,
+            origen TEXT NOT NULL,
+            destino TEXT NOT NULL,
+            visitas INTEGER NOT NULL,
+            PRIMARY KEY (dia, rango_edad, origen, destino)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS od_categorias (
+            dia TEXT NOT NULL,
+            rango_edad TEXT NOT NULL,
+            origen TEXT NOT NULL,
+            destino TEXT NOT NULL,
+            categoria TEXT NOT NULL,
+            pines INTEGER NOT NULL,
+            PRIMARY KEY (dia, rango_edad, origen, destino, categoria)
+        ) WITHOUT ROWID
+    """)
+
+
+# -----------------------
+# Normalización de llaves
+# -----------------------
+# Los lugares y edades se repiten mucho: cada valor distinto se calcula una vez
+@lru_cache(maxsize=65536)
+def normalizar_lugar(texto):
+    """'  UAM  Azcapotzalco ' y 'uam azcapotzalco' dan la misma llave."""
+    if not texto:
+        return SIN_DATO
+    texto = unicodedata.normalize("NFKD", str(texto))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"\s+", " ", texto).strip().casefold()
+    return texto or SIN_DATO
+
+
+@lru_cache(maxsize=1024)
+def rango_edad(edad):
+    try:
+        edad = int(edad)
+    except (TypeError, ValueError):
+        return SIN_DATO
+    etiqueta = SIN_DATO
+    for minimo, nombre in RANGOS_EDAD:
+        if edad >= minimo:
+            etiqueta = nombre
+    return etiqueta
+
+
+def _llaves(visita_id, edad, origen, destino, creado_en):
+    return (visita_id, str(creado_en)[:10], rango_edad(edad), normalizar_lugar(origen), normalizar_lugar(destino))
+
+
+# -----------------------
+# Mantenimiento incremental
+# -----------------------
+def registrar_visitas(db, filas):
+    """filas: (visita_id, edad, origen, destino, creado_en). Sin commit."""
+    llaves = [_llaves(*f) for f in filas]
+    if not llaves:
+        return
+    db.executemany(
+        "INSERT OR IGNORE INTO od_visitas (visita_id, dia, rango_edad, origen, destino) VALUES (?, ?, ?, ?, ?)",
+        llaves,
+    )
+    conteo = {}
+    for _, *clave in llaves:
+        conteo[tuple(clave)] = conteo.get(tuple(clave), 0) + 1
+    db.executemany(
+        """
+        INSERT INTO od_agregado (dia, rango_edad, origen, destino, visitas) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (dia, rango_edad, origen, destino) DO UPDATE SET visitas = visitas + excluded.visitas
+        """,
+        [(*k, n) for k, n in conteo.items()],
+    )
+
+
+def _sql_rango_edad(col):
+    """rango_edad como expresión SQL sobre `col` (mismo criterio que en Python)."""
+    entero = f"CAST({col} AS INTEGER)"
+    casos = " ".join(
+        f"WHEN {entero} >= {minimo} THEN '{nombre}'" for minimo, nombre in reversed(RANGOS_EDAD)
+    )
+    return f"CASE WHEN typeof({col}) IN ('integer', 'real') THEN CASE {casos} ELSE '{SIN_DATO}' END ELSE '{SIN_DATO}' END"
+
+
+def registrar_visitas_rango(db, id_desde, id_hasta):
+    """
+    Registra las visitas con id en [id_desde, id_hasta] (recién insertadas)
+    con INSERT ... SELECT, para importaciones masivas: sólo los lugares
+    distintos pasan por Python. Sin commit.
+    """
+    lugares = db.execute(
+        """
+        SELECT origen FROM visitas WHERE id BETWEEN ? AND ?
+        UNION SELECT destino FROM visitas WHERE id BETWEEN ? AND ?
+        """,
+        (id_desde, id_hasta, id_desde, id_hasta),
+    ).fetchall()
+    db.execute("CREATE TEMP TABLE IF NOT EXISTS od_lugares (lugar TEXT PRIMARY KEY, llave TEXT NOT NULL)")
+    db.execute("DELETE FROM temp.od_lugares")
+    db.executemany(
+        "INSERT OR IGNORE INTO temp.od_lugares (lugar, llave) VALUES (?, ?)",
+        [(lugar, normalizar_lugar(lugar)) for (lugar,) in lugares if lugar is not None],
+    )
+    db.execute(
+        f"""
+        INSERT OR IGNORE INTO od_visitas (visita_id, dia, rango_edad, origen, destino)
+        SELECT v.id, substr(v.creado_en, 1, 10), {_sql_rango_edad("v.edad")},
+               COALESCE(o.llave, '{SIN_DATO}'), COALESCE(d.llave, '{SIN_DATO}')
+        FROM visitas v
+        LEFT JOIN temp.od_lugares o ON o.lugar = v.origen
+        LEFT JOIN temp.od_lugares d ON d.lugar = v.destino
+        WHERE v.id BETWEEN ? AND ?
+        """,
+        (id_desde, id_hasta),
+    )
+    db.execute(
+        """
+        INSERT INTO od_agregado (dia, rango_edad, origen, destino, visitas)
+        SELECT dia, rango_edad, origen, destino, count(*)
+        FROM od_visitas
+        WHERE visita_id BETWEEN ? AND ?
+        GROUP BY dia, rango_edad, origen, destino
+        ON CONFLICT (dia, rango_edad, origen, destino) DO UPDATE SET visitas = visitas + excluded.visitas
+        """,
+        (id_desde, id_hasta),
+    )
+
+
+def registrar_visita(db, visita_id, edad, origen, destino, creado_en):
+    registrar_visitas(db, [(visita_id, edad, origen, destino, creado_en)])
+
+
+def registrar_pines(db, id_desde, id_hasta):
+    """Suma a od_categorias los pines con id en [id_desde, id_hasta]. Sin commit."""
+    db.execute(
+        """
+        INSERT INTO od_categorias (dia, rango_edad, origen, destino, categoria, pines)
+        SELECT v.dia, v.rango_edad, v.origen, v.destino, c.categoria, count(*)
+        FROM pines p
+        JOIN od_visitas v ON v.visita_id = p.visita_id
+        JOIN catalogo_pines c ON c.codigo = p.codigo_pin
+        WHERE p.id BETWEEN ? AND ?
+        GROUP BY v.dia, v.rango_edad, v.origen, v.destino, c.categoria
+        ON CONFLICT (dia, rango_edad, origen, destino, categoria) DO UPDATE SET pines = pines + excluded.pines
+        """,
+        (id_desde, id_hasta),
+    )
+
+
+def vacio(db):
+    return db.execute("SELECT 1 FROM od_visitas LIMIT 1").fetchone() is None
+
+
+def reconstruir(db):
+    """Vuelve a calcular las tablas OD con la base viva y las particiones."""
+    for tabla in ("od_visitas", "od_agregado", "od_categorias"):
+        db.execute(f"DELETE FROM {tabla}")
+
+    fuentes = [db]
+    for p in particiones.particiones_en_rango(db):
+        fuentes.append(particiones._conectar_solo_lectura(p["archivo"]))
+
+    for fuente in fuentes:
+        cur = fuente.execute("SELECT id, edad, origen, destino, creado_en FROM visitas")
+        while True:
+            filas = cur.fetchmany(10_000)
+            if not filas:
+                break
+            registrar_visitas(db, [tuple(f) for f in filas])
+
+    # Conteo de pines por categoría, también por partición
+    for fuente in fuentes:
+        cur = fuente.execute("SELECT visita_id, codigo_pin FROM pines")
+        conteo = {}
+        while True:
+            filas = cur.fetchmany(50_000)
+            if not filas:
+                break
+            for visita_id, codigo in filas:
+                conteo[(visita_id, codigo)] = conteo.get((visita_id, codigo), 0) + 1
+        db.executemany(
+            """
+            INSERT INTO od_categorias (dia, rango_edad, origen, destino, categoria, pines)
+            SELECT v.dia, v.rango_edad, v.origen, v.destino, c.categoria, ?
+            FROM od_visitas v, catalogo_pines c
+            WHERE v.visita_id = ? AND c.codigo = ?
+            ON CONFLICT (dia, rango_edad, origen, destino, categoria) DO UPDATE SET pines = pines + excluded.pines
+            """,
+            [(n, v, c) for (v, c), n in conteo.items()],
+        )
+
+    for fuente in fuentes[1:]:
+        fuente.close()
+
+
+# -----------------------
+# Consulta
+# -----------------------
+def matriz(db, desde=None, hasta=None, edades=None, categoria=None):
+    """
+    Flujos origen->destino agregados. `edades`: lista de rangos (RANGOS_EDAD).
+    `categoria`: None, "todas" o una categoría del catálogo para incluir el
+    conteo de pines de cada flujo.
+    """
+    clauses, params = [], []
+    if desde:
+        clauses.append("dia >= ?")
+        params.append(desde)
+    if hasta:
+        clauses.append("dia <= ?")
+        params.append(hasta)
+    if edades:
+        clauses.append(f"rango_edad IN ({','.join('?' * len(edades))})")
+        params.extend(edades)
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+
+    flujos = {}
+    for origen, destino, visitas in db.execute(
+        f"SELECT origen, destino, SUM(visitas) FROM od_agregado{where} "
+        "GROUP BY origen, destino ORDER BY SUM(visitas) DESC",
+        params,
+    ):
+        flujos[(origen, destino)] = {"origen": origen, "destino": destino, "visitas": visitas}
+
+    if categoria:
+        extra, extra_params = "", []
+        if categoria != "todas":
+            extra = (" AND " if where else " WHERE ") + "categoria = ?"
+            extra_params = [categoria]
+        for f in flujos.values():
+            f["pines"] = {}
+        for origen, destino, cat, pines in db.execute(
+            f"SELECT origen, destino, categoria, SUM(pines) FROM od_categorias{where}{extra} "
+            "GROUP BY origen, destino, categoria",
+            params + extra_params,
+        ):
+            if (origen, destino) in flujos:
+                flujos[(origen, destino)]["pines"][cat] = pines
+
+    origenes = sorted({f["origen"] for f in flujos.values()})
+    destinos = sorted({f["destino"] for f in flujos.values()})
+    pos_o = {o: i for i, o in enumerate(origenes)}
+    pos_d = {d: i for i, d in enumerate(destinos)}
+    tabla = [[0] * len(destinos) for _ in origenes]
+    for f in flujos.values():
+        tabla[pos_o[f["origen"]]][pos_d[f["destino"]]] = f["visitas"]
+
+    return {
+        "origenes": origenes,
+        "destinos": destinos,
+        "matriz": tabla,
+        "flujos": list(flujos.values()),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tablas de la matriz origen-destino")
+    parser.add_argument("--db", default=DB_PATH)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("reconstruir")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    crear_tablas(conn)
+    reconstruir(conn)
+    conn.commit()
+    n = conn.execute("SELECT count(*) FROM od_visitas").fetchone()[0]
+    conn.close()
+    print(f"Tablas OD reconstruidas ({n} visitas)")
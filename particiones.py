@@ -0,0 +1,240 @@
+"""
+Archivo por periodos de `pines` y `visitas`.
+
+Los periodos cerrados (un año, un semestre, una campaña) se mueven a un
+archivo SQLite propio en archivo/ que queda de sólo lectura. La tabla
+`particiones` de la base viva registra qué rango de fechas cubre cada uno.
+
+Las consultas pasan por `consultar`, que ejecuta la misma consulta sobre la
+base viva y sólo sobre las particiones cuyo rango se cruza con el de los
+filtros, y une los resultados en orden.
+
+Uso desde consola:
+    python particiones.py archivar 2024
+    python particiones.py archivar campaña_otoño --desde 2025-09-01 --hasta 2025-12-15
+    python particiones.py listar
+"""
+import argparse
+import calendar
+import heapq
+import os
+import re
+import sqlite3
+import stat
+from datetime import date, datetime
+
+BASE_DIR = os.path.dirname(__file__)
+DB_PATH = os.path.join(BASE_DIR, "pines.db")
+ARCHIVO_DIR = os.path.join(BASE_DIR, "archivo")
+
+TABLAS = ("visitas", "pines")
+
+
+def crear_tablas(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS particiones (
+            etiqueta TEXT PRIMARY KEY,
+            archivo TEXT NOT NULL,
+            desde TEXT NOT NULL,
+            hasta TEXT NOT NULL,
+            filas_visitas INTEGER NOT NULL,
+            filas_pines INTEGER NOT NULL,
+            creado_en TEXT NOT NULL
+        )
+    """)
+
+
+# -----------------------
+# Rangos de fechas
+# -----------------------
+def rango_de_filtros(date_str=None, month=None, year=None, start=None, end=None):
+    """
+    Rango (desde, hasta) en YYYY-MM-DD que cubren los filtros de /api/pins y
+    /exportar/excel (ya validados). None en un extremo = sin límite.
+    """
+    desde, hasta = None, None
+
+    def acotar(d, h):
+        nonlocal desde, hasta
+        if d and (desde is None or d > desde):
+            desde = d
+        if h and (hasta is None or h < hasta):
+            hasta = h
+
+    if date_str:
+        d = datetime.fromisoformat(date_str).date().isoformat()
+        acotar(d, d)
+    if month:
+        y, m = (int(x) for x in month.split("-"))
+        acotar(f"{y:04d}-{m:02d}-01", f"{y:04d}-{m:02d}-{calendar.monthrange(y, m)[1]:02d}")
+    if year:
+        acotar(f"{year}-01-01", f"{year}-12-31")
+    if start or end:
+        acotar(
+            datetime.fromisoformat(start).date().isoformat() if start else None,
+            datetime.fromisoformat(end).date().isoformat() if end else None,
+        )
+    return desde, hasta
+
+
+def particiones_en_rango(db, desde=None, hasta=None):
+    """Particiones cuyo rango se cruza con [desde, hasta]."""
+    q = "SELECT etiqueta, archivo FROM particiones WHERE 1=1"
+    params = []
+    if desde:
+        q += " AND hasta >= ?"
+        params.append(desde)
+    if hasta:
+        q += " AND desde <= ?"
+        params.append(hasta)
+    try:
+        return db.execute(q + " ORDER BY desde", params).fetchall()
+    except sqlite3.OperationalError:
+        # Base sin la tabla particiones (aún no se ha archivado nada)
+        return []
+
+
+def _conectar_solo_lectura(archivo):
+    conn = sqlite3.connect(f"file:{os.path.join(ARCHIVO_DIR, archivo)}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+# -----------------------
+# Ruteo de consultas
+# -----------------------
+def consultar(db, sql, params=(), rango=(None, None), orden="id"):
+    """
+    Ejecuta `sql` (SELECT sin ORDER BY) en la base viva y en las particiones
+    que se cruzan con `rango`, y devuelve todas las filas ordenadas por
+    `orden` ("id" o "id DESC"). Los ids se conservan al archivar, así que el
+    orden final es el mismo que tendría la tabla sin particionar.
+    """
+    columna, _, sentido = orden.partition(" ")
+    desc = sentido.upper() == "DESC"
+    sql_ordenado = f"{sql} ORDER BY {orden}"
+
+    fuentes = [db.execute(sql_ordenado, params).fetchall()]
+    for p in particiones_en_rango(db, *rango):
+        conn = _conectar_solo_lectura(p["archivo"])
+        try:
+            fuentes.append(conn.execute(sql_ordenado, params).fetchall())
+        finally:
+            conn.close()
+
+    if len(fuentes) == 1:
+        return fuentes[0]
+    return list(heapq.merge(*fuentes, key=lambda r: r[columna], reverse=desc))
+
+
+# -----------------------
+# Archivado
+# -----------------------
+def _rango_etiqueta(etiqueta):
+    if re.fullmatch(r"\d{4}", etiqueta):
+        return f"{etiqueta}-01-01", f"{etiqueta}-12-31"
+    m = re.fullmatch(r"(\d{4})-S([12])", etiqueta)
+    if m:
+        y = m.group(1)
+        return (f"{y}-01-01", f"{y}-06-30") if m.group(2) == "1" else (f"{y}-07-01", f"{y}-12-31")
+    raise ValueError("Indica --desde y --hasta (o usa una etiqueta YYYY o YYYY-S1/S2)")
+
+
+def archivar(db_path, etiqueta, desde=None, hasta=None):
+    """
+    Mueve las visitas y pines con `creado_en` en [desde, hasta] a
+    archivo/<etiqueta>.db y los borra de la base viva, todo en una sola
+    transacción. Sólo se permiten periodos ya cerrados y sin traslapes.
+    """
+    if not desde or not hasta:
+        desde, hasta = _rango_etiqueta(etiqueta)
+    desde = date.fromisoformat(desde).isoformat()
+    hasta = date.fromisoformat(hasta).isoformat()
+    if hasta >= date.today().isoformat():
+        raise ValueError("Sólo se pueden archivar periodos cerrados (hasta < hoy)")
+    if desde > hasta:
+        raise ValueError("desde debe ser anterior a hasta")
+
+    archivo = f"{re.sub(r'[^0-9A-Za-z_-]+', '_', etiqueta)}.db"
+    ruta = os.path.join(ARCHIVO_DIR, archivo)
+    os.makedirs(ARCHIVO_DIR, exist_ok=True)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    creado = False
+    try:
+        crear_tablas(conn)
+        if conn.execute("SELECT 1 FROM particiones WHERE etiqueta=?", (etiqueta,)).fetchone():
+            raise ValueError(f"La partición {etiqueta} ya existe")
+        if particiones_en_rango(conn, desde, hasta):
+            raise ValueError("El rango se traslapa con una partición existente")
+        if os.path.exists(ruta):
+            raise ValueError(f"Ya existe {ruta}")
+
+        conn.execute("ATTACH DATABASE ? AS part", (ruta,))
+        creado = True
+        conn.execute("BEGIN IMMEDIATE")
+        filtro = "date(creado_en) BETWEEN ? AND ?"
+        filas = {}
+        for tabla in TABLAS:
+            ddl = conn.execute(
+                "SELECT sql FROM main.sqlite_master WHERE type='table' AND name=?", (tabla,)
+            ).fetchone()["sql"]
+            conn.execute(ddl.replace(f"CREATE TABLE {tabla}", f"CREATE TABLE part.{tabla}", 1))
+            conn.execute(f"INSERT INTO part.{tabla} SELECT * FROM main.{tabla} WHERE {filtro}", (desde, hasta))
+            filas[tabla] = conn.execute(f"DELETE FROM main.{tabla} WHERE {filtro}", (desde, hasta)).rowcount
+        # Mismos índices de fecha que en la base viva
+        conn.execute("CREATE INDEX part.idx_pines_created ON pines(creado_en)")
+        conn.execute("CREATE INDEX part.idx_pines_visita ON pines(visita_id)")
+        conn.execute("CREATE INDEX part.idx_visitas_created ON visitas(creado_en)")
+        conn.execute(
+            """
+            INSERT INTO particiones (etiqueta, archivo, desde, hasta, filas_visitas, filas_pines, creado_en)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (etiqueta, archivo, desde, hasta, filas["visitas"], filas["pines"],
+             datetime.now().isoformat(timespec="seconds")),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        conn.close()
+        if creado and os.path.exists(ruta):
+            os.remove(ruta)
+        raise
+
+    conn.execute("DETACH DATABASE part")
+    conn.execute("VACUUM")
+    conn.close()
+    os.chmod(ruta, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    return {"etiqueta": etiqueta, "archivo": archivo, "desde": desde, "hasta": hasta, **filas}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archivo por periodos de pines y visitas.")
+    parser.add_argument("--db", default=DB_PATH)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    a = sub.add_parser("archivar", help="Mueve un periodo cerrado a su propio archivo")
+    a.add_argument("etiqueta", help="YYYY, YYYY-S1, YYYY-S2 o un nombre con --desde/--hasta")
+    a.add_argument("--desde")
+    a.add_argument("--hasta")
+    sub.add_parser("listar", help="Muestra las particiones registradas")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "archivar":
+        r = archivar(args.db, args.etiqueta, args.desde, args.hasta)
+        print(f"Archivado {r['etiqueta']} ({r['desde']} a {r['hasta']}): "
+              f"{r['visitas']} visitas, {r['pines']} pines -> archivo/{r['archivo']}")
+    else:
+        conn = sqlite3.connect(args.db)
+        crear_tablas(conn)
+        for row in conn.execute(
+            "SELECT etiqueta, desde, hasta, filas_visitas, filas_pines, archivo FROM particiones ORDER BY desde"
+        ):
+            print(" | ".join(str(x) for x in row))
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
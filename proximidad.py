@@ -0,0 +1,136 @@
+"""
+Índice de proximidad sobre capas de puntos (p. ej. Estaciones de Transporte).
+
+Los puntos de la capa se proyectan a UTM 14N (metros) y se agrupan en una
+cuadrícula. Para cada pin sólo se comparan las estaciones de las celdas
+vecinas, así que no se calculan todas las parejas pin-estación.
+
+El índice vive en memoria por proceso y se reconstruye cuando cambia el
+archivo de la capa (upload_layer lo reconstruye al subirla).
+"""
+import json
+import math
+import os
+import threading
+
+import numpy as np
+
+import proyecciones
+
+BASE_DIR = os.path.dirname(__file__)
+LAYERS_DIR = os.path.join(BASE_DIR, "static", "layers")
+
+# CRS métrico para CDMX (UTM zona 14N)
+CRS_METRICO = "EPSG:32614"
+# Lado de cada celda de la cuadrícula, en metros
+TAM_CELDA = 250.0
+
+_indices = {}
+_lock = threading.Lock()
+
+
+def proyectar(lat, lon):
+    """lat/lon (grados) -> arreglo (n, 2) de x/y en metros."""
+    a_metros = proyecciones.transformador(proyecciones.CRS_WGS84, CRS_METRICO)
+    x, y = a_metros.transform(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+    return np.column_stack([np.atleast_1d(x), np.atleast_1d(y)])
+
+
+class IndiceProximidad:
+    def __init__(self, features, tam_celda=TAM_CELDA):
+        lon, lat, origen = [], [], []
+        for i, f in enumerate(features):
+            geom = f.get("geometry") or {}
+            if geom.get("type") == "Point":
+                coords = [geom["coordinates"]]
+            elif geom.get("type") == "MultiPoint":
+                coords = geom["coordinates"]
+            else:
+                continue
+            for c in coords:
+                lon.append(c[0])
+                lat.append(c[1])
+                origen.append(i)
+
+        self.features = features
+        self.tam = tam_celda
+        self.origen = np.asarray(origen, dtype=np.int64)
+        self.xy = proyectar(lat, lon) if origen else np.empty((0, 2))
+
+        # Celdas ocupadas y los índices de los puntos que caen en cada una
+        celdas = {}
+        if len(self.xy):
+            claves = np.floor(self.xy / self.tam).astype(np.int64)
+            for j, clave in enumerate(map(tuple, claves)):
+                celdas.setdefault(clave, []).append(j)
+        self.ocupadas = np.asarray(list(celdas), dtype=np.int64).reshape(-1, 2)
+        self.puntos_celda = [np.asarray(v) for v in celdas.values()]
+
+    def __len__(self):
+        return len(self.xy)
+
+    def cercanos(self, lat, lon):
+        """
+        Para cada punto (lat, lon) devuelve (distancias en metros, índice de
+        la feature más cercana). Los puntos se agrupan por celda y cada grupo
+        se compara sólo contra los puntos de las celdas de su vecindario.
+        """
+        q = proyectar(lat, lon)
+        dist = np.full(len(q), np.inf)
+        idx = np.full(len(q), -1, dtype=np.int64)
+        if not len(self.xy) or not len(q):
+            return dist, idx
+
+        claves = np.floor(q / self.tam).astype(np.int64)
+        unicas, grupo = np.unique(claves, axis=0, return_inverse=True)
+        grupo = grupo.reshape(-1)
+        orden = np.argsort(grupo, kind="stable")
+        cortes = np.searchsorted(grupo[orden], np.arange(len(unicas) + 1))
+
+        for g, celda in enumerate(unicas):
+            # Distancia en celdas (Chebyshev) a cada celda ocupada
+            anillos = np.abs(self.ocupadas - celda).max(axis=1)
+            r = anillos.min()
+            # El punto en el anillo r está a lo más (r+1)*tam*√2; uno más
+            # cercano no puede estar más allá de este anillo.
+            vecinas = np.nonzero(anillos <= math.ceil((r + 1) * math.sqrt(2)) + 1)[0]
+            cand = np.concatenate([self.puntos_celda[k] for k in vecinas])
+
+            sel = orden[cortes[g]:cortes[g + 1]]
+            d = np.linalg.norm(q[sel, None, :] - self.xy[None, cand, :], axis=2)
+            mejor = d.argmin(axis=1)
+            dist[sel] = d[np.arange(len(sel)), mejor]
+            idx[sel] = self.origen[cand[mejor]]
+
+        return dist, idx
+
+
+def _ruta(filename):
+    return os.path.join(LAYERS_DIR, os.path.basename(filename))
+
+
+def reconstruir(filename):
+    """Construye (o vuelve a construir) el índice de la capa `filename`."""
+    ruta = _ruta(filename)
+    mtime = os.path.getmtime(ruta)
+    with open(ruta, encoding="utf-8") as f:
+        features = json.load(f).get("features", [])
+    indice = IndiceProximidad(features)
+    with _lock:
+        _indices[filename] = (mtime, indice)
+    return indice
+
+
+def obtener(filename):
+    """Índice de la capa; se reconstruye si el archivo cambió (otro worker)."""
+    mtime = os.path.getmtime(_ruta(filename))
+    with _lock:
+        actual = _indices.get(filename)
+    if actual and actual[0] == mtime:
+        return actual[1]
+    return reconstruir(filename)
+
+
+def descartar(filename):
+    with _lock:
+        _indices.pop(filename, None)
@@ -0,0 +1,104 @@
+"""
+Sistemas de coordenadas de las capas subidas.
+
+- `crs_de_shapefile` lee el .prj que acompaña al .shp y lo resuelve a un
+  CRS (código EPSG cuando pyproj lo reconoce). Sin .prj se decide una sola
+  vez para toda la capa con su bbox: si cabe en grados es WGS84, si no se
+  asume UTM 14N (CRS_POR_DEFECTO), como se hacía antes.
+- `transformador` guarda los `pyproj.Transformer` ya construidos en un LRU
+  del proceso; construirlos es lo caro, usarlos no.
+- `reproyectar` transforma todas las coordenadas de la capa en una sola
+  llamada con arreglos numpy.
+"""
+import os
+from functools import lru_cache
+
+import numpy as np
+import pyproj
+
+CRS_WGS84 = "EPSG:4326"
+# Lo que se asumía para todas las capas antes de leer el .prj (CDMX)
+CRS_POR_DEFECTO = "EPSG:32614"
+
+
+def _llave(crs):
+    """Texto estable para un CRS: 'EPSG:xxxx' si se reconoce, si no su WKT."""
+    autoridad = crs.to_authority(min_confidence=70)
+    if autoridad:
+        return f"{autoridad[0]}:{autoridad[1]}"
+    return crs.to_wkt()
+
+
+def buscar_prj(shp_path):
+    """Ruta del .prj con el mismo nombre que el .shp (sin importar mayúsculas)."""
+    carpeta = os.path.dirname(shp_path)
+    base = os.path.splitext(os.path.basename(shp_path))[0].lower()
+    for f in os.listdir(carpeta):
+        nombre, ext = os.path.splitext(f)
+        if ext.lower() == ".prj" and nombre.lower() == base:
+            return os.path.join(carpeta, f)
+    return None
+
+
+def crs_de_shapefile(shp_path, bbox=None):
+    """
+    Llave del CRS de la capa. Lanza ValueError si el .prj existe pero no se
+    puede interpretar.
+    """
+    prj = buscar_prj(shp_path)
+    if prj:
+        with open(prj, encoding="utf-8", errors="replace") as f:
+            wkt = f.read().strip()
+        try:
+            return _llave(pyproj.CRS.from_user_input(wkt))
+        except pyproj.exceptions.CRSError as e:
+            raise ValueError(f"No se reconoce el sistema de coordenadas del .prj: {e}") from e
+
+    if bbox is not None and -180 <= bbox[0] <= bbox[2] <= 180 and -90 <= bbox[1] <= bbox[3] <= 90:
+        return CRS_WGS84
+    return CRS_POR_DEFECTO
+
+
+@lru_cache(maxsize=32)
+def transformador(origen, destino=CRS_WGS84):
+    """Transformer (x, y) -> (lon, lat) compartido por todo el proceso."""
+    return pyproj.Transformer.from_crs(origen, destino, always_xy=True)
+
+
+# -----------------------
+# Reproyección por capa
+# -----------------------
+def _aplanar(coords, xs, ys):
+    if isinstance(coords[0], (list, tuple)):
+        for c in coords:
+            _aplanar(c, xs, ys)
+    else:
+        xs.append(coords[0])
+        ys.append(coords[1])
+
+
+def _rearmar(coords, pares):
+    if isinstance(coords[0], (list, tuple)):
+        return [_rearmar(c, pares) for c in coords]
+    return next(pares)
+
+
+def reproyectar(geometrias, origen, destino=CRS_WGS84):
+    """
+    Reproyecta en su lugar las geometrías GeoJSON (dicts con 'coordinates')
+    de una capa completa de `origen` a `destino`.
+    """
+    geometrias = [g for g in geometrias if g and g.get("coordinates")]
+    if origen == destino or not geometrias:
+        return
+
+    xs, ys = [], []
+    for g in geometrias:
+        _aplanar(g["coordinates"], xs, ys)
+    x, y = transformador(origen, destino).transform(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+    if not (np.isfinite(x).all() and np.isfinite(y).all()):
+        raise ValueError(f"Coordenadas fuera del dominio de {origen}")
+
+    pares = iter(np.column_stack((x, y)).tolist())
+    for g in geometrias:
+        g["coordinates"] = _rearmar(g["coordinates"], pares)
@@ -0,0 +1,256 @@
+"""
+Respaldos en línea de pines.db con la API de backup de SQLite.
+
+La base trabaja en modo WAL: la copia abre una transacción de lectura (una
+foto consistente de la base) y la copia por bloques de páginas con una
+pausa entre bloques. En WAL los lectores no bloquean a los escritores, así
+que los pines que se guardan mientras tanto no esperan, y como la foto no
+cambia el respaldo no se reinicia con cada escritura. Cada respaldo se
+verifica con `PRAGMA integrity_check`, se comprime con gzip y se rotan los
+más viejos.
+
+Las particiones de archivo/ son de sólo lectura y no cambian; basta con
+copiarlas una vez, no forman parte de estos respaldos.
+
+Uso desde consola:
+    python respaldo.py crear
+    python respaldo.py listar
+    python respaldo.py verificar pines_20260120_164603.db.gz
+    python respaldo.py restaurar pines_20260120_164603.db.gz
+    python respaldo.py benchmark
+"""
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(__file__)
+DB_PATH = os.path.join(BASE_DIR, "pines.db")
+RESPALDOS_DIR = os.path.join(BASE_DIR, "respaldos")
+
+# Páginas copiadas por paso y pausa entre pasos (segundos)
+PAGINAS_POR_PASO = 256
+PAUSA = 0.01
+# Respaldos que se conservan al rotar
+RETENCION = 14
+
+
+def _copiar_en_linea(origen, destino, paginas=PAGINAS_POR_PASO, pausa=PAUSA):
+    """Copia la base `origen` (ruta) a `destino` (ruta) con la API de backup."""
+    src = sqlite3.connect(origen, isolation_level=None)
+    dst = sqlite3.connect(destino)
+    try:
+        src.execute("PRAGMA journal_mode=WAL")
+        # Foto fija del origen mientras dura la copia
+        src.execute("BEGIN")
+        src.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        src.backup(dst, pages=paginas, progress=lambda *_: time.sleep(pausa) if pausa else None)
+        src.execute("COMMIT")
+    finally:
+        dst.close()
+        src.close()
+
+
+def integridad(ruta):
+    """Resultado de PRAGMA integrity_check ("ok" si la base está sana)."""
+    conn = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True)
+    try:
+        return "; ".join(r[0] for r in conn.execute("PRAGMA integrity_check"))
+    finally:
+        conn.close()
+
+
+def crear_respaldo(db_path=DB_PATH, destino_dir=RESPALDOS_DIR, prefijo="pines",
+                   paginas=PAGINAS_POR_PASO, pausa=PAUSA, retencion=RETENCION):
+    """Crea, verifica y comprime un respaldo. Devuelve la ruta del .db.gz."""
+    os.makedirs(destino_dir, exist_ok=True)
+    nombre = f"{prefijo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db.gz"
+    ruta = os.path.join(destino_dir, nombre)
+
+    with tempfile.TemporaryDirectory(dir=destino_dir) as tmp:
+        copia = os.path.join(tmp, "copia.db")
+        _copiar_en_linea(db_path, copia, paginas, pausa)
+
+        resultado = integridad(copia)
+        if resultado != "ok":
+            raise RuntimeError(f"El respaldo no pasó integrity_check: {resultado}")
+
+        with open(copia, "rb") as f_in, gzip.open(ruta + ".tmp", "wb", compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+        os.replace(ruta + ".tmp", ruta)
+
+    if retencion:
+        rotar(destino_dir, prefijo, retencion)
+    return ruta
+
+
+def listar(destino_dir=RESPALDOS_DIR):
+    """Respaldos disponibles, del más reciente al más viejo."""
+    if not os.path.isdir(destino_dir):
+        return []
+    nombres = [f for f in os.listdir(destino_dir) if f.endswith(".db.gz")]
+    return sorted(nombres, key=lambda f: os.path.getmtime(os.path.join(destino_dir, f)), reverse=True)
+
+
+def rotar(destino_dir=RESPALDOS_DIR, prefijo="pines", conservar=RETENCION):
+    """Borra los respaldos de `prefijo` más viejos, dejando `conservar`."""
+    propios = [f for f in listar(destino_dir) if f.startswith(prefijo + "_")]
+    for nombre in propios[conservar:]:
+        os.remove(os.path.join(destino_dir, nombre))
+
+
+def _ruta_respaldo(nombre, destino_dir=RESPALDOS_DIR):
+    ruta = os.path.join(destino_dir, os.path.basename(nombre))
+    if not os.path.exists(ruta):
+        raise FileNotFoundError(f"No existe el respaldo {nombre}")
+    return ruta
+
+
+def _descomprimir(ruta, destino):
+    with gzip.open(ruta, "rb") as f_in, open(destino, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out, 1 << 20)
+
+
+def verificar(nombre, destino_dir=RESPALDOS_DIR):
+    """Descomprime el respaldo en un temporal y corre integrity_check."""
+    ruta = _ruta_respaldo(nombre, destino_dir)
+    with tempfile.TemporaryDirectory() as tmp:
+        copia = os.path.join(tmp, "verificar.db")
+        _descomprimir(ruta, copia)
+        return integridad(copia)
+
+
+def restaurar(nombre, db_path=DB_PATH, destino_dir=RESPALDOS_DIR):
+    """
+    Restaura un respaldo sobre la base viva usando también la API de backup
+    (respeta los candados de las demás conexiones). Antes se guarda un
+    respaldo del estado actual con prefijo `antes_de_restaurar`.
+    """
+    ruta = _ruta_respaldo(nombre, destino_dir)
+    with tempfile.TemporaryDirectory() as tmp:
+        copia = os.path.join(tmp, "restaurar.db")
+        _descomprimir(ruta, copia)
+        resultado = integridad(copia)
+        if resultado != "ok":
+            raise RuntimeError(f"El respaldo no pasó integrity_check: {resultado}")
+
+        previo = crear_respaldo(db_path, destino_dir, prefijo="antes_de_restaurar")
+        _copiar_en_linea(copia, db_path, paginas=-1, pausa=0)
+    return previo
+
+
+# -----------------------
+# Benchmark de latencia de escritura
+# -----------------------
+def _latencias_escritura(db_path, duracion=0, en_paralelo=None):
+    """Inserta pines durante `duracion` s y devuelve la latencia de cada commit (ms)."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    latencias = []
+    hilo = threading.Thread(target=en_paralelo) if en_paralelo else None
+    if hilo:
+        hilo.start()
+    fin = time.perf_counter() + duracion
+    while time.perf_counter() < fin or (hilo and hilo.is_alive()):
+        t = time.perf_counter()
+        conn.execute(
+            "INSERT INTO pines (visita_id, codigo_pin, lat, lon, dentro_malla, creado_en) VALUES (1, 'VIP', 19.5, -99.18, 1, ?)",
+            (datetime.now().isoformat(timespec="seconds"),),
+        )
+        conn.commit()
+        latencias.append((time.perf_counter() - t) * 1000)
+        time.sleep(0.002)
+    if hilo:
+        hilo.join()
+    conn.close()
+    return latencias
+
+
+def _copia_bloqueante(db_path):
+    """Como el respaldo anterior: una sola lectura larga en modo journal clásico."""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("BEGIN")
+    for tabla in [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]:
+        for _ in conn.execute(f"SELECT * FROM {tabla}"):
+            pass
+    conn.execute("COMMIT")
+    conn.close()
+
+
+def benchmark(filas=1_000_000, duracion=3.0):
+    """
+    Latencia de los commits de un escritor: sin respaldo, durante un respaldo
+    en línea (WAL, por pasos) y durante una lectura completa de la base en
+    modo journal clásico, como hacía el respaldo a Excel.
+    """
+    def resumen(nombre, lat):
+        lat = sorted(lat)
+        p99 = lat[min(len(lat) - 1, int(len(lat) * 0.99))]
+        print(f"{nombre:<28} n={len(lat):>5}  p50={statistics.median(lat):6.2f} ms  "
+              f"p99={p99:7.2f} ms  max={lat[-1]:8.2f} ms")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        conn = sqlite3.connect(db)
+        conn.execute("""
+            CREATE TABLE pines (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, visita_id INTEGER NOT NULL,
+                codigo_pin TEXT NOT NULL, lat REAL NOT NULL, lon REAL NOT NULL,
+                nom TEXT, idu TEXT, dentro_malla INTEGER, creado_en TEXT NOT NULL)
+        """)
+        conn.executemany(
+            "INSERT INTO pines (visita_id, codigo_pin, lat, lon, nom, dentro_malla, creado_en) VALUES (?, 'VIP', 19.5, -99.18, ?, 1, '2025-01-01T00:00:00')",
+            ((i, "/static/img/Sticker Violencia - 01.png") for i in range(filas)),
+        )
+        conn.commit()
+        conn.close()
+        print(f"Base de prueba: {filas:,} pines, {os.path.getsize(db) / 2**20:.1f} MiB")
+
+        resumen("journal: sin respaldo", _latencias_escritura(db, duracion))
+        resumen(
+            "journal: lectura completa",
+            _latencias_escritura(db, en_paralelo=lambda: _copia_bloqueante(db)),
+        )
+        conn = sqlite3.connect(db)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.close()
+        resumen("WAL: sin respaldo", _latencias_escritura(db, duracion))
+        resumen(
+            "WAL: respaldo en línea",
+            _latencias_escritura(db, en_paralelo=lambda: crear_respaldo(db, os.path.join(tmp, "r"), retencion=0)),
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Respaldos en línea de pines.db")
+    parser.add_argument("--db", default=DB_PATH)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("crear")
+    sub.add_parser("listar")
+    sub.add_parser("verificar").add_argument("nombre")
+    sub.add_parser("restaurar").add_argument("nombre")
+    b = sub.add_parser("benchmark")
+    b.add_argument("--filas", type=int, default=1_000_000)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "crear":
+        print(crear_respaldo(args.db))
+    elif args.cmd == "listar":
+        for nombre in listar():
+            print(nombre)
+    elif args.cmd == "verificar":
+        print(verificar(args.nombre))
+    elif args.cmd == "restaurar":
+        previo = restaurar(args.nombre, args.db)
+        print(f"Restaurado {args.nombre} (estado previo guardado en {previo})")
+    else:
+        benchmark(args.filas)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Sesiones del lado del servidor guardadas en SQLite (sesiones.db).
+
+La cookie sólo lleva un id opaco; los datos y la última actividad viven en
+la tabla `sesiones`, compartida por todos los workers de gunicorn. Así la
+cookie se envía una sola vez (al crear la sesión) en lugar de volver a
+firmarse y mandarse en cada respuesta.
+
+- La actividad se registra en memoria con `session.tocar()` y sólo se
+  escribe si pasaron más de INTERVALO_ACTIVIDAD segundos desde la última.
+- Las rutas estáticas no abren ni guardan sesión.
+- Las sesiones viejas se purgan de vez en cuando por `ultima_actividad`.
+- Al iniciar sesión (participante o admin) se llama `session.regenerar()`:
+  el sid cambia y el anterior se borra, así un sid fijado de antemano no
+  sirve después del login.
+"""
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+BASE_DIR = os.path.dirname(__file__)
+SESIONES_DB = os.path.join(BASE_DIR, "sesiones.db")
+
+# Cada cuánto se escribe la última actividad como máximo (segundos)
+INTERVALO_ACTIVIDAD = 15
+# Cuánto se conserva una sesión sin actividad antes de purgarla (segundos).
+# Es mayor que el tiempo de inactividad de la app para poder avisar
+# "Sesión finalizada por inactividad" en vez de empezar de cero.
+RETENCION = 24 * 3600
+# Cada cuántos segundos un proceso purga sesiones viejas
+INTERVALO_PURGA = 300
+
+# Prefijos que no usan sesión
+RUTAS_SIN_SESION = ("/static/", "/sprites/")
+
+
+class SesionServidor(CallbackDict, SessionMixin):
+    def __init__(self, datos=None, sid=None, ultima_actividad=None, nueva=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(datos, on_update)
+        self.sid = sid
+        self.new = nueva
+        self.modified = False
+        self.omitida = False
+        self.ultima_actividad = ultima_actividad
+        self._actividad_guardada = ultima_actividad
+        self.sid_anterior = None
+
+    def tocar(self):
+        """Registra actividad; se escribe como mucho cada INTERVALO_ACTIVIDAD."""
+        self.ultima_actividad = time.time()
+
+    def regenerar(self):
+        """Nuevo sid con los mismos datos; llamar al cambiar de privilegio."""
+        if not self.new:
+            self.sid_anterior = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+    @property
+    def actividad_pendiente(self):
+        return (
+            self.ultima_actividad is not None
+            and (self._actividad_guardada is None
+                 or self.ultima_actividad - self._actividad_guardada >= INTERVALO_ACTIVIDAD)
+        )
+
+
+class AlmacenSesiones:
+    def __init__(self, path=SESIONES_DB):
+        self.path = path
+        self._local = threading.local()
+        self._ultima_purga = 0.0
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sesiones (
+                sid TEXT PRIMARY KEY,
+                datos TEXT NOT NULL,
+                ultima_actividad REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sesiones_actividad ON sesiones(ultima_actividad)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def leer(self, sid):
+        return self._conn().execute(
+            "SELECT datos, ultima_actividad FROM sesiones WHERE sid=?", (sid,)
+        ).fetchone()
+
+    def guardar(self, sid, datos, ultima_actividad):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO sesiones (sid, datos, ultima_actividad) VALUES (?, ?, ?)",
+            (sid, datos, ultima_actividad),
+        )
+        self._purgar()
+
+    def tocar(self, sid, ultima_actividad):
+        self._conn().execute(
+            "UPDATE sesiones SET ultima_actividad=? WHERE sid=?", (ultima_actividad, sid)
+        )
+
+    def borrar(self, sid):
+        self._conn().execute("DELETE FROM sesiones WHERE sid=?", (sid,))
+
+    def _purgar(self):
+        ahora = time.time()
+        if ahora - self._ultima_purga < INTERVALO_PURGA:
+            return
+        self._ultima_purga = ahora
+        self._conn().execute("DELETE FROM sesiones WHERE ultima_actividad < ?", (ahora - RETENCION,))
+
+
+class InterfazSesionServidor(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, almacen=None):
+        self.almacen = almacen or AlmacenSesiones()
+
+    def open_session(self, app, request):
+        if request.path.startswith(RUTAS_SIN_SESION):
+            sesion = SesionServidor()
+            sesion.omitida = True
+            return sesion
+
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            row = self.almacen.leer(sid)
+            if row:
+                try:
+                    datos = self.serializer.loads(row[0])
+                except Exception:
+                    datos = {}
+                return SesionServidor(datos, sid=sid, ultima_actividad=row[1])
+        return SesionServidor(sid=secrets.token_urlsafe(32), nueva=True)
+
+    def save_session(self, app, session, response):
+        if session.omitida:
+            return
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.sid_anterior:
+            self.almacen.borrar(session.sid_anterior)
+
+        if not session:
+            if not session.new:
+                self.almacen.borrar(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified or session.new:
+            self.almacen.guardar(
+                session.sid, self.serializer.dumps(dict(session)),
+                session.ultima_actividad or time.time(),
+            )
+        elif session.actividad_pendiente:
+            self.almacen.tocar(session.sid, session.ultima_actividad)
+
+        # La cookie sólo se manda cuando se crea (o regenera) la sesión
+        if session.new:
+            response.set_cookie(
+                name,
+                session.sid,
+                httponly=self.get_cookie_httponly(app),
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+                domain=domain,
+                path=path,
+            )
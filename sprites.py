@@ -0,0 +1,193 @@
+"""
+Atlas de iconos (sprite) para los pines del mapa y los iconos de las capas.
+
+Los iconos originales son PNG de ~470px; aquí se reducen al tamaño de
+marcador y se empaquetan en una sola imagen (WebP + PNG de respaldo) con un
+índice JSON por código de `catalogo_pines`. Así el mapa descarga una sola
+imagen pequeña en vez de una por icono.
+
+Uso desde consola (reconstruye el atlas con los iconos de pines.db):
+    python sprites.py
+"""
+import hashlib
+import json
+import math
+import os
+import sqlite3
+from io import BytesIO
+
+from PIL import Image
+
+BASE_DIR = os.path.dirname(__file__)
+IMG_DIR = os.path.join(BASE_DIR, "static", "img")
+LAYERS_DIR = os.path.join(BASE_DIR, "static", "layers")
+SPRITES_DIR = os.path.join(BASE_DIR, "static", "sprites")
+INDEX_PATH = os.path.join(SPRITES_DIR, "pines.json")
+
+# Tamaño de cada celda del atlas: el doble del marcador más grande (36px)
+# para que se vea nítido en pantallas de alta densidad.
+TAM_ICONO = 72
+
+# Imagen fuente de cada código del catálogo (la misma que usa index.html)
+ICONOS_CATALOGO = {
+    "VIP": "Sticker Violencia - 01.png",
+    "AEP": "Sticker Violencia - 02.png",
+    "VIO": "Sticker Violencia - 03.png",
+    "VFI": "Sticker Violencia - 04.png",
+    "FEM": "Sticker Violencia - 05.png",
+    "VIN": "Sticker Violencia - 06.png",
+    "VPA": "Sticker Violencia - 07.png",
+    "VCO": "Sticker Violencia - 08.png",
+    "DEB": "Stickers entorno urbano-01.png",
+    "EVP": "Stickers entorno urbano-02.png",
+    "COV": "Stickers entorno urbano-03.png",
+    "BAP": "Stickers entorno urbano-04.png",
+    "CRI": "Stickers entorno urbano-05.png",
+    "CAI": "Stickers entorno urbano-06.png",
+    "CME": "Stickers entorno urbano-07.png",
+    "CSC": "Stickers entorno urbano-08.png",
+    "STP": "Stickers entorno urbano-09.png",
+}
+
+# Generaciones de atlas que se conservan en disco al reconstruir
+ATLAS_CONSERVADOS = 3
+
+# Prefijo de las claves del atlas para iconos de capas subidas por admin
+PREFIJO_CAPA = "capa:"
+
+
+def normalizar_imagen(src, tam=TAM_ICONO):
+    """Abre `src` (ruta o archivo) y la ajusta a un cuadro de `tam` x `tam`."""
+    with Image.open(src) as im:
+        im = im.convert("RGBA")
+        # Recortar márgenes transparentes antes de escalar
+        bbox = im.getchannel("A").getbbox()
+        if bbox:
+            im = im.crop(bbox)
+        im.thumbnail((tam, tam), Image.LANCZOS)
+
+    lienzo = Image.new("RGBA", (tam, tam), (0, 0, 0, 0))
+    lienzo.paste(im, ((tam - im.width) // 2, (tam - im.height) // 2), im)
+    return lienzo
+
+
+def normalizar_icono(src, dst_path, tam=TAM_ICONO):
+    """Guarda en `dst_path` (PNG) la versión normalizada del icono `src`."""
+    normalizar_imagen(src, tam).save(dst_path, format="PNG", optimize=True)
+    return dst_path
+
+
+def _escribir(ruta, datos):
+    """Escribe a un temporal y lo renombra: nadie ve el archivo a medias."""
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(datos)
+    os.replace(tmp, ruta)
+
+
+def _limpiar_anteriores(actual):
+    """
+    Borra atlas viejos dejando las ATLAS_CONSERVADOS generaciones más
+    recientes: las páginas ya abiertas (o el índice que otro worker acaba de
+    escribir) siguen apuntando a URLs que existen.
+    """
+    generaciones = {}
+    for f in os.listdir(SPRITES_DIR):
+        partes = f.split(".")
+        if len(partes) == 3 and partes[0] == "pines" and partes[2] in ("webp", "png"):
+            ruta = os.path.join(SPRITES_DIR, f)
+            try:
+                mtime = os.path.getmtime(ruta)
+            except FileNotFoundError:
+                continue
+            generaciones.setdefault(partes[1], []).append((mtime, ruta))
+    recientes = sorted(generaciones, key=lambda d: max(m for m, _ in generaciones[d]), reverse=True)
+    for digest in recientes[ATLAS_CONSERVADOS:]:
+        if digest == actual:
+            continue
+        for _, ruta in generaciones[digest]:
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+
+
+def construir_atlas(codigos=None, capas=(), tam=TAM_ICONO):
+    """
+    Empaqueta los iconos en una cuadrícula y escribe el atlas y su índice.
+
+    `codigos`: códigos de `catalogo_pines` a incluir (por defecto todos los
+    de ICONOS_CATALOGO). `capas`: iconos de capas ya guardados en
+    static/layers (nombres de archivo). Los nombres de las imágenes llevan
+    un hash del contenido para poder servirlas con caché inmutable.
+    """
+    if codigos is None:
+        codigos = list(ICONOS_CATALOGO)
+
+    fuentes = []
+    for codigo in codigos:
+        nombre = ICONOS_CATALOGO.get(codigo)
+        if nombre and os.path.exists(os.path.join(IMG_DIR, nombre)):
+            fuentes.append((codigo, os.path.join(IMG_DIR, nombre)))
+    for icono in capas:
+        ruta = os.path.join(LAYERS_DIR, icono)
+        if icono and not icono.lower().endswith(".svg") and os.path.exists(ruta):
+            fuentes.append((PREFIJO_CAPA + icono, ruta))
+
+    cols = max(1, math.ceil(math.sqrt(len(fuentes))))
+    filas = max(1, math.ceil(len(fuentes) / cols))
+    atlas = Image.new("RGBA", (cols * tam, filas * tam), (0, 0, 0, 0))
+
+    iconos = {}
+    for i, (clave, ruta) in enumerate(fuentes):
+        x, y = (i % cols) * tam, (i // cols) * tam
+        atlas.paste(normalizar_imagen(ruta, tam), (x, y))
+        iconos[clave] = {"x": x, "y": y}
+
+    webp = BytesIO()
+    atlas.save(webp, format="WEBP", quality=90, method=6)
+    png = BytesIO()
+    atlas.save(png, format="PNG", optimize=True)
+    digest = hashlib.sha1(png.getvalue()).hexdigest()[:10]
+
+    os.makedirs(SPRITES_DIR, exist_ok=True)
+    webp_name = f"pines.{digest}.webp"
+    png_name = f"pines.{digest}.png"
+    _escribir(os.path.join(SPRITES_DIR, webp_name), webp.getvalue())
+    _escribir(os.path.join(SPRITES_DIR, png_name), png.getvalue())
+
+    indice = {
+        "tam": tam,
+        "ancho": atlas.width,
+        "alto": atlas.height,
+        "webp": webp_name,
+        "png": png_name,
+        "iconos": iconos,
+    }
+    # El índice se cambia sólo cuando las imágenes nuevas ya existen
+    _escribir(INDEX_PATH, json.dumps(indice).encode("utf-8"))
+    _limpiar_anteriores(digest)
+    return indice
+
+
+def cargar_indice():
+    """Devuelve el índice del atlas o None si aún no se ha construido."""
+    try:
+        with open(INDEX_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def reconstruir_desde_db(db):
+    """Reconstruye el atlas con el catálogo y los iconos de capas de `db`."""
+    codigos = [r[0] for r in db.execute("SELECT codigo FROM catalogo_pines ORDER BY codigo")]
+    capas = [r[0] for r in db.execute("SELECT icon FROM layers WHERE icon IS NOT NULL ORDER BY id")]
+    return construir_atlas(codigos, capas)
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(os.path.join(BASE_DIR, "pines.db"))
+    indice = reconstruir_desde_db(conn)
+    conn.close()
+    print(f"Atlas generado: {indice['webp']} ({len(indice['iconos'])} iconos)")